@@ -0,0 +1,340 @@
+import math
+import numpy as np
+
+from sim import Sim
+
+# Structure-of-arrays enemy store for very large endless waves. Every column
+# is a NumPy array and the per-tick work (movement, guard slows, leaks,
+# deaths, rewards, compaction) runs as batch operations over all enemies.
+# ArraySim is a drop-in Sim that uses it; numpy is only needed if you ask
+# for it.
+
+class EnemyArrays:
+    def __init__(self, enemy_defs, route, capacity=256):
+        self.kinds = list(enemy_defs)
+        self.kind_ids = {k: i for i, k in enumerate(self.kinds)}
+        self.kind_names = np.array(self.kinds, dtype=object)
+        self.kind_hp = np.array([enemy_defs[k]["hp"] for k in self.kinds], dtype=np.float64)
+        self.kind_speed = np.array([enemy_defs[k]["speed"] for k in self.kinds], dtype=np.float64)
+        self.kind_reward = np.array([enemy_defs[k]["reward"] for k in self.kinds], dtype=np.int64)
+        self.kind_leak = np.array([enemy_defs[k]["leak"] for k in self.kinds], dtype=np.int64)
+
+        self.length = route.length
+        self.cum = np.array(route.cum[:-1], dtype=np.float64)
+        segs = np.array(route.segs, dtype=np.float64)
+        self.seg_ax, self.seg_ay, self.seg_ux, self.seg_uy = segs.T.copy()
+        self.seg_len = np.array(route.lens, dtype=np.float64)
+        self.start = route.points[0]
+
+        self.n = 0
+        self.kind = np.zeros(capacity, dtype=np.int16)
+        self.hp = np.zeros(capacity, dtype=np.int64)
+        self.max_hp = np.zeros(capacity, dtype=np.int64)
+        self.speed = np.zeros(capacity, dtype=np.float64)
+        self.dist = np.zeros(capacity, dtype=np.float64)
+        self.x = np.zeros(capacity, dtype=np.float64)
+        self.y = np.zeros(capacity, dtype=np.float64)
+        self.px = np.zeros(capacity, dtype=np.float64)
+        self.py = np.zeros(capacity, dtype=np.float64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.leaked = np.zeros(capacity, dtype=bool)
+
+    COLUMNS = ("kind", "hp", "max_hp", "speed", "dist", "x", "y", "px", "py", "alive", "leaked")
+
+    def _grow(self):
+        cap = len(self.hp) * 2
+        for name in self.COLUMNS:
+            old = getattr(self, name)
+            col = np.zeros(cap, dtype=old.dtype)
+            col[:self.n] = old[:self.n]
+            setattr(self, name, col)
+
+    def spawn(self, kind, hp_scale=1.0):
+        if self.n == len(self.hp):
+            self._grow()
+        i = self.n
+        k = self.kind_ids[kind]
+        hp = int(self.kind_hp[k] * hp_scale)
+        self.kind[i] = k
+        self.hp[i] = hp
+        self.max_hp[i] = hp
+        self.speed[i] = self.kind_speed[k]
+        self.dist[i] = 0.0
+        self.x[i], self.y[i] = self.start
+        self.px[i], self.py[i] = self.start
+        self.alive[i] = True
+        self.leaked[i] = False
+        self.n += 1
+        return i
+
+    def move(self):
+        n = self.n
+        self.px[:n] = self.x[:n]
+        self.py[:n] = self.y[:n]
+        alive = self.alive[:n]
+        dist = self.dist[:n]
+        # Path.advance() for every enemy at once.
+        last = len(self.cum) - 1
+        seg = np.minimum(np.searchsorted(self.cum, dist, side="right") - 1, last)
+        t = (dist - self.cum[seg] + self.speed[:n]) / self.seg_len[seg]
+        over = alive & (t >= 1)
+        while over.any():
+            t[over] -= 1
+            seg[over] += 1
+            over &= (t >= 1) & (seg <= last)
+        ended = seg > last
+        seg = np.minimum(seg, last)
+        np.copyto(dist, np.where(ended, self.length, self.cum[seg] + t * self.seg_len[seg]), where=alive)
+        out = alive & (dist >= self.length)
+        if out.any():
+            alive[out] = False
+            self.leaked[:n][out] = True
+        seg = np.searchsorted(self.cum, dist, side="right") - 1
+        d = dist - self.cum[seg]
+        self.x[:n] = self.seg_ax[seg] + self.seg_ux[seg] * d
+        self.y[:n] = self.seg_ay[seg] + self.seg_uy[seg] * d
+        return int(self.kind_leak[self.kind[:n][out]].sum()), int(np.count_nonzero(out))
+
+    def apply_slow(self, slow_map):
+        # Base speed times the guard factor at each enemy's distance; this
+        # is the whole per-tick speed update.
+        n = self.n
+        base = self.kind_speed[self.kind[:n]]
+        if slow_map is None:
+            self.speed[:n] = base
+            return
+        i = np.searchsorted(slow_map.breaks, self.dist[:n], side="right") - 1
+        factors = np.asarray(slow_map.factors)
+        self.speed[:n] = base * np.where(i >= 0, factors[i], 1.0)
+
+    def in_range(self, x, y, r):
+        n = self.n
+        return self.alive[:n] & (np.abs(self.x[:n] - x) <= r) & (np.abs(self.y[:n] - y) <= r)
+
+    def damage(self, i, dmg):
+        self.hp[i] -= dmg
+        if self.hp[i] <= 0:
+            self.alive[i] = False
+
+    def splash(self, x, y, r, dmg):
+        n = self.n
+        m = self.alive[:n] & (np.hypot(self.x[:n] - x, self.y[:n] - y) < r)
+        hp = self.hp[:n]
+        hp[m] -= dmg
+        self.alive[:n][m & (hp <= 0)] = False
+
+    def collect(self):
+        n = self.n
+        dead = ~self.alive[:n] & ~self.leaked[:n]
+        return int(self.kind_reward[self.kind[:n][dead]].sum()), int(np.count_nonzero(dead))
+
+    def compact(self):
+        # Drops dead and leaked rows. Returns the old-row -> new-row map, with
+        # -1 for dropped rows, or None if nothing moved.
+        n = self.n
+        keep = self.alive[:n].copy()
+        k = int(np.count_nonzero(keep))
+        if k == n:
+            return None
+        remap = np.where(keep, np.cumsum(keep) - 1, -1)
+        for name in self.COLUMNS:
+            col = getattr(self, name)
+            col[:k] = col[:n][keep]
+        self.n = k
+        return remap
+
+class EnemyRow:
+    __slots__ = ("kind", "x", "y", "px", "py", "hp", "max_hp")
+
+    def __init__(self, kind, x, y, px, py, hp, max_hp):
+        self.kind = kind
+        self.x = x
+        self.y = y
+        self.px = px
+        self.py = py
+        self.hp = hp
+        self.max_hp = max_hp
+
+class RowBullet:
+    __slots__ = ("x", "y", "px", "py", "row", "dmg", "splash", "alive")
+
+    def __init__(self, x, y, row, dmg, splash=0):
+        self.setup(x, y, row, dmg, splash)
+
+    def setup(self, x, y, row, dmg, splash=0):
+        self.x = self.px = float(x)
+        self.y = self.py = float(y)
+        self.row = row
+        self.dmg = dmg
+        self.splash = splash
+        self.alive = True
+
+    def update(self, arr):
+        i = self.row
+        if not arr.alive[i]:
+            self.alive = False
+            return
+        self.px, self.py = self.x, self.y
+        tx = float(arr.x[i])
+        ty = float(arr.y[i])
+        dx = tx - self.x
+        dy = ty - self.y
+        dist = math.hypot(dx, dy)
+        if dist < 8:
+            if self.splash > 0:
+                arr.splash(tx, ty, self.splash, self.dmg)
+            else:
+                arr.damage(i, self.dmg)
+            self.alive = False
+            return
+        self.x += dx / dist * 9
+        self.y += dy / dist * 9
+
+class ArraySim(Sim):
+    @property
+    def enemies(self):
+        # A row object per enemy; fine for tools, too slow to draw from.
+        a = self.arr
+        kinds = a.kinds
+        n = a.n
+        return [EnemyRow(kinds[k], x, y, px, py, hp, mhp) for k, x, y, px, py, hp, mhp, alive in zip(
+            a.kind[:n].tolist(), a.x[:n].tolist(), a.y[:n].tolist(), a.px[:n].tolist(), a.py[:n].tolist(),
+            a.hp[:n].tolist(), a.max_hp[:n].tolist(), a.alive[:n].tolist()) if alive]
+
+    @enemies.setter
+    def enemies(self, value):
+        # Sim.reset() assigns an empty list; start a fresh store instead.
+        self.arr = EnemyArrays(self.enemy_defs, self.map.route)
+
+    def spawn(self, kind, hp_scale):
+        return self.arr.spawn(kind, hp_scale)
+
+    def enemy_count(self):
+        return self.arr.n
+
+    def fire(self, t, row):
+        if self.bullet_pool:
+            b = self.bullet_pool.pop()
+            b.setup(t.x, t.y, row, t.dmg, t.splash)
+        else:
+            b = RowBullet(t.x, t.y, row, t.dmg, t.splash)
+        self.bullets.append(b)
+        return b
+
+    def compact(self):
+        # Drops dead and leaked rows, then moves the surviving bullets onto
+        # their targets' new rows, dropping spent ones in place and
+        # recycling them.
+        remap = self.arr.compact()
+        rows = None if remap is None else remap.tolist()
+        bullets = self.bullets
+        pool = self.bullet_pool
+        j = 0
+        for b in bullets:
+            if b.alive and rows is not None:
+                b.row = rows[b.row]
+            if b.alive and b.row >= 0:
+                bullets[j] = b
+                j += 1
+            else:
+                pool.append(b)
+        del bullets[j:]
+
+    def enemy_columns(self):
+        # Kind, x, y, px, py, hp and max_hp for the draw path, one tolist()
+        # per column. step() compacts every tick, so all rows are alive.
+        a = self.arr
+        n = a.n
+        return (a.kind_names[a.kind[:n]].tolist(), a.x[:n].tolist(), a.y[:n].tolist(), a.px[:n].tolist(),
+                a.py[:n].tolist(), a.hp[:n].tolist(), a.max_hp[:n].tolist())
+
+    def save_units(self):
+        a = self.arr
+        enemies = (a.n,) + tuple(getattr(a, name)[:a.n].tobytes() for name in a.COLUMNS)
+        bullets = tuple((b.x, b.y, b.px, b.py, b.row, b.dmg, b.splash) for b in self.bullets)
+        return enemies, bullets
+
+    def load_units(self, enemies, bullets):
+        self.enemies = []
+        a = self.arr
+        n = enemies[0]
+        while len(a.hp) < n:
+            a._grow()
+        for name, data in zip(a.COLUMNS, enemies[1:]):
+            col = getattr(a, name)
+            col[:n] = np.frombuffer(data, dtype=col.dtype)
+        a.n = n
+        self.bullets = []
+        for x, y, px, py, row, dmg, splash in bullets:
+            b = RowBullet(x, y, row, dmg, splash)
+            b.px, b.py = px, py
+            self.bullets.append(b)
+
+    def pick(self, t, m):
+        a = self.arr
+        idx = np.flatnonzero(m)
+        if not idx.size:
+            return -1
+        if t.target == "last":
+            return int(idx[np.argmin(a.dist[idx])])
+        if t.target == "strongest":
+            return int(idx[np.lexsort((a.dist[idx], a.hp[idx]))[-1]])
+        if t.target == "closest":
+            # Equally close enemies go to the one furthest back, as Sim's
+            # min() over its distance-sorted candidates does.
+            d2 = (a.x[idx] - t.x) ** 2 + (a.y[idx] - t.y) ** 2
+            return int(idx[np.lexsort((a.dist[idx], d2))[0]])
+        return int(idx[np.argmax(a.dist[idx])])
+
+    def step(self):
+        if self.state != "wave":
+            return
+        a = self.arr
+        prof = self.profile
+        self.tick += 1
+        due = self.spawns.pop_due(self.tick)
+        while due:
+            self.spawn(*due)
+            due = self.spawns.pop_due(self.tick)
+        if prof:
+            prof.mark("spawn")
+
+        leak_dmg, leaks = a.move()
+        if leaks:
+            self.lives -= leak_dmg
+            self.wave_leaks += leaks
+            if self.lives <= 0:
+                self.state = "gameover"
+
+        a.apply_slow(self.slow_map)
+        if prof:
+            prof.mark("move")
+
+        for t in self.towers:
+            if t.slow:
+                continue
+            t.cd = max(0, t.cd - 1)
+            if t.cd > 0:
+                continue
+            i = self.pick(t, a.in_range(t.x, t.y, t.rng))
+            if i >= 0:
+                self.fire(t, i)
+                t.cd = t.rate
+        if prof:
+            prof.mark("target")
+
+        for b in self.bullets:
+            b.update(a)
+
+        reward, kills = a.collect()
+        self.gold += reward
+        self.score += reward
+        self.wave_kills += kills
+        self.compact()
+
+        if not self.spawns and not a.n and self.state == "wave":
+            self.wave_num += 1
+            self.gold += 30 + self.wave_num * 8
+            self.state = "build"
+        if prof:
+            prof.mark("bullets")
@@ -0,0 +1,31 @@
+# Image tables shared by main.py, china_game.py and webbundle.py: name ->
+# (file, size it is drawn at). MAP_ASSETS is what the first screen (map
+# and shop) needs, ENEMY_ASSETS what is only needed once a wave starts.
+
+MAP_ASSETS = {
+    "castle": ("castle.jpg", 150),
+    "tower": {
+        "bowman":   ("bowman.jpg", 64),
+        "crossbow": ("crossbowman.jpg", 56),
+        "guard":    ("gaurd.jpg", 52),
+    },
+    "shop": {
+        "bowman":   ("bowman.jpg", 52),
+        "crossbow": ("crossbowman.jpg", 52),
+        "guard":    ("gaurd.jpg", 52),
+    },
+}
+
+ENEMY_ASSETS = {
+    "enemy": {
+        "barbarian": ("barbarians.jpg", 48),
+        "raider":    ("secondhardest.jpeg", 52),
+        "shield":    ("thirdhardest.jpg", 56),
+        "siege":     ("fourthhardest.jpg", 60),
+        "general":   ("hardestenemy.jpg", 68),
+    },
+}
+
+# The folder main.py loads webbundle.py's pre-scaled images from, next to
+# itself. A bundle built elsewhere with --out is staged under this name.
+WEB_BUNDLE = "web_assets"
@@ -0,0 +1,299 @@
+import argparse, gc, importlib, json, os, platform, subprocess, sys, time, tracemalloc
+
+from sim import Sim, MAX_LEVEL
+
+# Benchmarks for the sim tick and the rendered frame, run headless under the
+# SDL dummy driver. Sim scenarios are timed in-process one tick at a time;
+# render scenarios run each game script in its own process and time
+# draw_frame() plus the present, one sim tick per frame. Memory scenarios
+# replay MEM_SCENARIOS under tracemalloc.
+#
+#   python bench.py                        run everything and print a table
+#   python bench.py --out base.json        also save the results
+#   python bench.py --baseline base.json   compare; exits 1 on a regression
+#   python bench.py --only wave12 --only china-4k
+#   python bench.py --only mem --arrays     memory use of the wave-30 test
+
+KINDS = ["bowman", "crossbow", "bowman", "guard"]
+
+RENDER_TARGETS = {
+    "main": ("main", []),
+    "china-1080p": ("china_game", ["--size", "1920x1080"]),
+    "china-1440p": ("china_game", ["--size", "2560x1440"]),
+    "china-4k": ("china_game", ["--size", "3840x2160"]),
+    "china-1080p-720p": ("china_game", ["--size", "1920x1080", "--render", "1280x720"]),
+    "china-4k-720p": ("china_game", ["--size", "3840x2160", "--render", "1280x720"]),
+}
+
+def free_cells(game, near_path):
+    m = game.map
+    cells = []
+    for col in range(m.cols):
+        for row in range(m.rows):
+            if not game.can_place(col, row):
+                continue
+            if not near_path or any((col + dc, row + dr) in m.path_cells
+                                    for dc in (-1, 0, 1) for dr in (-1, 0, 1)):
+                cells.append((col, row))
+    return cells
+
+def build(game, cells, level):
+    game.gold = 10 ** 9
+    for i, (col, row) in enumerate(cells):
+        t = game.place(KINDS[i % len(KINDS)], col, row)
+        for _ in range(level - 1):
+            game.upgrade(t)
+
+def start(game, wave):
+    game.lives = 10 ** 9
+    game.wave_num = wave - 1
+    game.start_wave()
+
+# name: (wave, towers, warm-up ticks). towers is None for an empty map,
+# "ring" for every cell touching the path or "all" for every free cell,
+# with the level to upgrade them to.
+SCENARIOS = {
+    "build": (None, None, 0),
+    "wave1": (1, ("ring", 1, 4), 90),
+    "wave12": (12, ("ring", 3, None), 300),
+    "endless50": (50, ("ring", MAX_LEVEL, None), 600),
+    "maxed": (30, ("all", MAX_LEVEL, None), 600),
+}
+
+# The wave-30 stress test, run under tracemalloc for the mem/ results.
+MEM_SCENARIOS = ["maxed"]
+
+def setup(game, name):
+    wave, towers, warmup = SCENARIOS[name]
+    if towers:
+        where, level, count = towers
+        build(game, free_cells(game, where == "ring")[:count], level)
+    game.gold = 200
+    if wave:
+        start(game, wave)
+    for _ in range(warmup):
+        tick(game, wave)
+
+def tick(game, wave):
+    game.step()
+    if wave and game.state != "wave":
+        start(game, wave)
+
+def percentiles(xs):
+    xs = sorted(xs)
+    n = len(xs)
+    return {
+        "mean": sum(xs) / n,
+        "p50": xs[n // 2],
+        "p95": xs[min(n - 1, int(n * 0.95))],
+        "p99": xs[min(n - 1, int(n * 0.99))],
+        "max": xs[-1],
+    }
+
+def bench_sim(cls, name, ticks):
+    game = cls(seed=1)
+    setup(game, name)
+    wave = SCENARIOS[name][0]
+    gc.collect()
+    clock = time.perf_counter
+    times = []
+    enemies = 0
+    for _ in range(ticks):
+        t0 = clock()
+        game.step()
+        times.append((clock() - t0) * 1000)
+        enemies += game.enemy_count()
+        if wave and game.state != "wave":
+            start(game, wave)
+    total = sum(times) / 1000
+    return {
+        "ticks_per_sec": ticks / total if total else 0.0,
+        "tick_ms": percentiles(times),
+        "enemies": enemies / ticks,
+        "towers": len(game.towers),
+    }
+
+def bench_mem(cls, name, ticks):
+    # The peak traced over the run and the blocks allocated during it that
+    # are still held at the end. With pooled entities a steady wave should
+    # keep both flat however long it runs.
+    game = cls(seed=1)
+    setup(game, name)
+    wave = SCENARIOS[name][0]
+    gc.collect()
+    tracemalloc.start()
+    for _ in range(ticks):
+        tick(game, wave)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(s.count for s in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+    return {
+        "peak_kb": peak / 1024,
+        "held_kb": current / 1024,
+        "blocks": blocks,
+        "enemies": game.enemy_count(),
+        "towers": len(game.towers),
+    }
+
+def bench_render(module, args, name, frames):
+    # Runs in a child process: importing the game script opens its window.
+    import pygame
+    sys.argv = [module + ".py"] + args
+    mod = importlib.import_module(module)
+    game = mod.game
+    setup(game, name)
+    wave = SCENARIOS[name][0]
+    mod.alpha = 0.5
+    clock = time.perf_counter
+    times = []
+    for i in range(frames + 10):
+        pygame.event.pump()
+        tick(game, wave)
+        t0 = clock()
+        mod.draw_frame(0, 0)
+        if mod.surfaces.frame_allocs:
+            mod.dirty.invalidate()
+        mod.dirty.present(mod.screen.get_size())
+        if i >= 10:
+            times.append((clock() - t0) * 1000)
+    return {
+        "frame_ms": percentiles(times),
+        "fps": 1000 / (sum(times) / len(times)),
+        "size": "x".join(map(str, pygame.display.get_surface().get_size())),
+        "enemies": game.enemy_count(),
+        "towers": len(game.towers),
+    }
+
+def run_render(target, name, frames):
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy",
+               PYGAME_HIDE_SUPPORT_PROMPT="1")
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", target, name, str(frames)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if out.returncode:
+        raise RuntimeError(f"render/{target}/{name} failed:\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def show(key, r):
+    if "tick_ms" in r:
+        t = r["tick_ms"]
+        print(f"{key:<32} {r['ticks_per_sec']:>9.0f} ticks/s  tick ms p50 {t['p50']:.3f} "
+              f"p95 {t['p95']:.3f} p99 {t['p99']:.3f}  ({r['enemies']:.0f} enemies, {r['towers']} towers)",
+              flush=True)
+    elif "peak_kb" in r:
+        print(f"{key:<32} {r['peak_kb']:>9.0f} KB peak  held {r['held_kb']:.0f} KB in {r['blocks']} blocks  "
+              f"({r['enemies']} enemies, {r['towers']} towers)", flush=True)
+    else:
+        f = r["frame_ms"]
+        print(f"{key:<32} {r['fps']:>9.0f} fps      frame ms p50 {f['p50']:.2f} "
+              f"p95 {f['p95']:.2f} p99 {f['p99']:.2f}  ({r['size']}, {r['enemies']} enemies)", flush=True)
+
+# (metric path, higher is better)
+METRICS = [
+    (("ticks_per_sec",), True),
+    (("tick_ms", "p95"), False),
+    (("frame_ms", "p50"), False),
+    (("frame_ms", "p95"), False),
+    (("peak_kb",), False),
+    (("blocks",), False),
+]
+
+def lookup(r, path):
+    for p in path:
+        if not isinstance(r, dict) or p not in r:
+            return None
+        r = r[p]
+    return r
+
+def compare(results, baseline, tolerance):
+    regressions = 0
+    print(f"\ncompared with baseline ({baseline['meta']['date']}), tolerance {tolerance:.0%}")
+    for key, r in results.items():
+        old = baseline["results"].get(key)
+        if old is None:
+            print(f"{key:<32} new")
+            continue
+        for path, higher in METRICS:
+            a, b = lookup(old, path), lookup(r, path)
+            if a is None or b is None or not a:
+                continue
+            change = (b - a) / a
+            worse = -change if higher else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            regressions += bool(flag)
+            print(f"{key:<32} {'.'.join(path):<14} {a:>10.3f} -> {b:>10.3f}  {change:+7.1%}  {flag}")
+    return regressions
+
+def selected(key, only):
+    return not only or any(o in key for o in only)
+
+def main(argv):
+    if argv[1:2] == ["--worker"]:
+        target, name, frames = argv[2], argv[3], int(argv[4])
+        module, args = RENDER_TARGETS[target]
+        print(json.dumps(bench_render(module, args, name, frames)))
+        return 0
+
+    ap = argparse.ArgumentParser(description="Sim tick and frame render benchmarks.")
+    ap.add_argument("--only", action="append", default=[], metavar="TEXT",
+                    help="only run benchmarks whose name contains TEXT")
+    ap.add_argument("--ticks", type=int, default=2000, help="ticks per sim scenario")
+    ap.add_argument("--frames", type=int, default=120, help="frames per render scenario")
+    ap.add_argument("--repeat", type=int, default=3, help="sim runs per scenario; the fastest is kept")
+    ap.add_argument("--arrays", action="store_true", help="also benchmark ArraySim")
+    ap.add_argument("--out", help="write results as JSON to this file")
+    ap.add_argument("--baseline", help="compare against results saved with --out")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before flagging")
+    args = ap.parse_args(argv[1:])
+
+    sims = [("sim", Sim)]
+    if args.arrays:
+        from arrays import ArraySim
+        sims.append(("arrays", ArraySim))
+
+    results = {}
+    for label, cls in sims:
+        for name in SCENARIOS:
+            key = f"{label}/{name}"
+            if selected(key, args.only):
+                runs = [bench_sim(cls, name, args.ticks) for _ in range(args.repeat)]
+                results[key] = max(runs, key=lambda r: r["ticks_per_sec"])
+                show(key, results[key])
+        for name in MEM_SCENARIOS:
+            key = f"mem/{label}/{name}"
+            if selected(key, args.only):
+                results[key] = bench_mem(cls, name, args.ticks)
+                show(key, results[key])
+    for target in RENDER_TARGETS:
+        for name in SCENARIOS:
+            key = f"render/{target}/{name}"
+            if selected(key, args.only):
+                results[key] = run_render(target, name, args.frames)
+                show(key, results[key])
+
+    report = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "ticks": args.ticks,
+            "frames": args.frames,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,142 @@
+import argparse, os, random, sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+from gfx import Upscaler
+from sim import SpawnTimeline, WAVES, HP_GROWTH, wave_groups
+
+# Correctness checks for the parts whose output can be compared against a
+# slower, obviously right version, run headless under the SDL dummy driver.
+#
+#   python checks.py                 run every check; exits 1 on a failure
+#   python checks.py --only present --only spawns
+
+def check_present(frames=200):
+    # Moving sprites presented through Upscaler's dirty rects must leave the
+    # display exactly as scaling the whole render target would.
+    ok = True
+    for display, render in (((1920, 1080), (1280, 720)), ((2000, 1125), (1280, 720)),
+                            ((2560, 1440), (1280, 720)), ((3840, 2160), (1280, 720))):
+        screen = pygame.display.set_mode(display)
+        surf = pygame.Surface(render).convert()
+        rng = random.Random(1)
+        for _ in range(300):
+            pygame.draw.circle(surf, [rng.randrange(256) for _ in range(3)],
+                               (rng.randrange(render[0]), rng.randrange(render[1])), rng.randrange(3, 40))
+        background = surf.copy()
+        # A few sprites kept inside one box, so the dirty area stays small
+        # enough for partial presents.
+        box = pygame.Rect(200, 150, 360, 240)
+        sprites = [[rng.randrange(box.x, box.right - 40), rng.randrange(box.y, box.bottom - 40),
+                    rng.choice((-3, -1, 1, 2)), rng.choice((-2, 1, 3)), [rng.randrange(256) for _ in range(3)]]
+                   for _ in range(6)]
+        up = Upscaler(surf, screen)
+        up.present(render)
+        ref = pygame.Surface(up.rect.size, 0, up.target)
+        bad = partial = 0
+        for _ in range(frames):
+            for s in sprites:
+                old = pygame.Rect(s[0], s[1], 40, 40)
+                surf.blit(background, old, old)
+                s[0] = min(max(s[0] + s[2], box.x), box.right - 40)
+                s[1] = min(max(s[1] + s[3], box.y), box.bottom - 40)
+                up.add(old)
+                up.add(pygame.draw.circle(surf, s[4], (s[0] + 20, s[1] + 20), 18))
+            up.present(render)
+            partial += up.last_count > 0
+            if up.integer:
+                pygame.transform.scale(surf, up.rect.size, ref)
+            else:
+                pygame.transform.smoothscale(surf, up.rect.size, ref)
+            if pygame.image.tobytes(up.target.copy(), "RGB") != pygame.image.tobytes(ref, "RGB"):
+                bad += 1
+        mode = "integer" if up.integer else "fit"
+        print(f"present {display[0]}x{display[1]} from {render[0]}x{render[1]} ({mode}): "
+              f"{frames - bad}/{frames} frames exact, {partial} partial presents")
+        ok = ok and not bad
+    return ok
+
+def flat_spawns(groups, tick, hp_scale):
+    # The reference for SpawnTimeline: the groups expanded up front into one
+    # list the way the old build_spawn_list() did, and each spawn given the
+    # tick the old countdown timer would have fired it on. Groups with a
+    # start offset get their own countdown, held back that many ticks past
+    # the wave's first step.
+    queues = [(0, [])]
+    for g in groups:
+        if len(g) < 4:
+            queues[0][1].extend([(g[0], g[2])] * g[1])
+        else:
+            queues.append((g[3], [(g[0], g[2])] * g[1]))
+    out = []
+    for seq, (offset, queue) in enumerate(queues):
+        timer = offset + 1
+        t = tick
+        for kind, delay in queue:
+            while True:
+                t += 1
+                timer -= 1
+                if timer <= 0:
+                    break
+            out.append((t, seq, kind, hp_scale))
+            timer = delay
+    out.sort()
+    return [(t, kind, hp_scale) for t, seq, kind, hp_scale in out]
+
+def timeline_spawns(groups, tick, hp_scale):
+    # The same groups drawn from a SpawnTimeline the way Sim.step() does.
+    spawns = SpawnTimeline()
+    spawns.start(tick, groups, hp_scale)
+    out = []
+    while spawns:
+        tick += 1
+        due = spawns.pop_due(tick)
+        while due:
+            out.append((tick,) + due)
+            due = spawns.pop_due(tick)
+    return out
+
+def check_spawns():
+    # The table waves, the same waves with later groups overlapping on
+    # start offsets (as sweep.py can set), and 60 endless waves per seed.
+    # Both sides schedule the same rolled groups; only the timing differs.
+    staggered = [[g + (i * 45,) if i else g for i, g in enumerate(w)] for w in WAVES]
+    checked = 0
+    for waves in (WAVES, staggered):
+        for seed in range(5):
+            rng = random.Random(seed)
+            for wave_idx in range(len(waves) + 60):
+                groups = wave_groups(wave_idx, waves, rng)
+                tick = wave_idx * 1000
+                hp_scale = 1.0 + wave_idx * HP_GROWTH
+                want = flat_spawns(groups, tick, hp_scale)
+                got = timeline_spawns(groups, tick, hp_scale)
+                if got != want:
+                    n = next((i for i, (x, y) in enumerate(zip(got, want)) if x != y), min(len(got), len(want)))
+                    print(f"spawns wave {wave_idx + 1} seed {seed}: spawn {n} differs: "
+                          f"timeline {got[n:n + 1]} flat {want[n:n + 1]} ({len(got)} vs {len(want)} spawns)")
+                    return False
+                checked += len(want)
+    print(f"spawns: {checked} spawns match a flat spawn list")
+    return True
+
+CHECKS = {
+    "present": check_present,
+    "spawns": check_spawns,
+}
+
+def main(argv):
+    ap = argparse.ArgumentParser(description="Correctness checks against reference implementations.")
+    ap.add_argument("--only", action="append", default=[], metavar="NAME",
+                    help="only run this check: " + ", ".join(CHECKS))
+    args = ap.parse_args(argv[1:])
+    pygame.init()
+    failed = [name for name, check in CHECKS.items() if (not args.only or name in args.only) and not check()]
+    if failed:
+        print("FAILED:", ", ".join(failed))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,679 @@
+import csv, hashlib, io, json, os, sys, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+# pygame-side helpers shared by main.py and china_game.py.
+
+class AssetLoader:
+    # Square images at the sizes the game draws them. load() takes a
+    # (nested) dict of name -> (filename, size) and returns the same shape
+    # with surfaces. Each file is read and decoded at most once however many
+    # sizes it is used at, and the scaled pixels are kept in cache_dir keyed
+    # by the file's hash and the size, so a warm start decodes nothing.
+    # Files are handled on a thread pool (decode and smoothscale release the
+    # GIL); the results are converted to the display format at the end.
+    # A bundle made by webbundle.py is used instead of the originals in the
+    # browser, or when the originals are not there.
+    def __init__(self, root, cache_dir=None, workers=None, bundle=None):
+        self.root = root
+        self.cache_dir = os.path.join(root, ".asset_cache") if cache_dir is None else cache_dir
+        # No threads or persistent disk in the browser build.
+        self.web = sys.platform == "emscripten"
+        self.workers = workers
+        self.bundle = bundle
+        self.bundled = {}
+        if bundle and os.path.exists(os.path.join(bundle, "manifest.json")):
+            with open(os.path.join(bundle, "manifest.json")) as f:
+                self.bundled = json.load(f)["images"]
+        self.decoded = 0
+        self.from_cache = 0
+        self.from_bundle = 0
+
+    def cache_path(self, digest, size, mode):
+        return os.path.join(self.cache_dir, f"{digest}-{size}.{mode.lower()}")
+
+    def read_cached(self, digest, size):
+        if self.web:
+            return None
+        for mode in ("RGB", "RGBA"):
+            path = self.cache_path(digest, size, mode)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return pygame.image.frombytes(f.read(), (size, size), mode)
+        return None
+
+    def write_cached(self, digest, size, surf):
+        if self.web:
+            return
+        mode = "RGBA" if surf.get_flags() & pygame.SRCALPHA else "RGB"
+        path = self.cache_path(digest, size, mode)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(pygame.image.tobytes(surf, mode))
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def load_file(self, filename, sizes):
+        path = os.path.join(self.root, filename)
+        entry = self.bundled.get(filename)
+        if entry and (self.web or not os.path.exists(path)) and all(str(s) in entry["sizes"] for s in sizes):
+            self.from_bundle += len(sizes)
+            return {s: pygame.image.load(os.path.join(self.bundle, entry["sizes"][str(s)])) for s in sizes}
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()[:16]
+        src = None
+        out = {}
+        for size in sizes:
+            s = self.read_cached(digest, size)
+            if s is not None:
+                self.from_cache += 1
+            else:
+                if src is None:
+                    src = pygame.image.load(io.BytesIO(data), filename)
+                    self.decoded += 1
+                s = pygame.transform.smoothscale(src, (size, size))
+                self.write_cached(digest, size, s)
+            out[size] = s
+        return out
+
+    def wanted(self, spec):
+        # file -> sizes, in the order files first appear in spec.
+        wanted = {}
+        def collect(node):
+            for v in node.values():
+                if isinstance(v, dict):
+                    collect(v)
+                else:
+                    wanted.setdefault(v[0], set()).add(v[1])
+        collect(spec)
+        return wanted
+
+    def build(self, spec, files):
+        out = {}
+        for k, v in spec.items():
+            if isinstance(v, dict):
+                out[k] = self.build(v, files)
+            else:
+                s = files[v[0]][v[1]]
+                out[k] = s.convert_alpha() if s.get_flags() & pygame.SRCALPHA else s.convert()
+        return out
+
+    def load(self, spec):
+        wanted = self.wanted(spec)
+        if self.web or self.workers == 0:
+            files = {name: self.load_file(name, sizes) for name, sizes in wanted.items()}
+        else:
+            with ThreadPoolExecutor(self.workers) as pool:
+                jobs = {name: pool.submit(self.load_file, name, sizes) for name, sizes in wanted.items()}
+                files = {name: job.result() for name, job in jobs.items()}
+        return self.build(spec, files)
+
+    def steps(self, spec, out):
+        # load() one file at a time, for the browser build where nothing may
+        # hold up the event loop for long. Yields (done, total) after each
+        # file; out is filled with the surfaces before the last yield.
+        wanted = self.wanted(spec)
+        files = {}
+        for name, sizes in wanted.items():
+            files[name] = self.load_file(name, sizes)
+            if len(files) == len(wanted):
+                out.update(self.build(spec, files))
+            yield len(files), len(wanted)
+
+class SpriteAtlas:
+    # Packs sprites into shared display-format surfaces so a whole layer can
+    # be drawn with a single Surface.blits() call of (surface, dest, rect)
+    # entries; sprites[key] is the (surface, rect) pair. Opaque sprites go
+    # into one plain surface. See-through ones are drawn on blank() and go
+    # into a second, colour-keyed surface, since keyed blits are slower.
+    KEY = (255, 0, 255)
+
+    def __init__(self, width=1024, pad=1):
+        self.width = width
+        self.pad = pad
+        self.pending = []
+        self.sprites = {}
+
+    def blank(self, size):
+        s = pygame.Surface(size).convert()
+        s.fill(self.KEY)
+        s.set_colorkey(self.KEY)
+        return s
+
+    def add(self, key, surf):
+        self.pending.append((key, surf))
+
+    def pack_sheet(self, items, keyed):
+        # Shelf packing, tallest first.
+        x = y = shelf = 0
+        rects = {}
+        for key, s in sorted(items, key=lambda p: -p[1].get_height()):
+            w, h = s.get_size()
+            if x + w > self.width:
+                x = 0
+                y += shelf + self.pad
+                shelf = 0
+            rects[key] = pygame.Rect(x, y, w, h)
+            x += w + self.pad
+            shelf = max(shelf, h)
+        if keyed:
+            sheet = self.blank((self.width, y + shelf))
+        else:
+            sheet = pygame.Surface((self.width, y + shelf)).convert()
+        for key, s in items:
+            sheet.blit(s, rects[key])
+            self.sprites[key] = (sheet, rects[key])
+
+    def pack(self):
+        opaque = [p for p in self.pending if p[1].get_colorkey() is None]
+        keyed = [p for p in self.pending if p[1].get_colorkey() is not None]
+        if opaque:
+            self.pack_sheet(opaque, False)
+        if keyed:
+            self.pack_sheet(keyed, True)
+        self.pending = []
+
+class SurfaceCache:
+    # Surfaces the draw_* helpers reuse every frame: plain fills keyed by
+    # size and colour, plus pre-rendered ones keyed by whatever they depend
+    # on. Everything is dropped when the screen size changes. allocs and
+    # frame_allocs are debug counters; frame_allocs stays 0 in steady state.
+    def __init__(self):
+        self.surfs = {}
+        self.size = None
+        self.allocs = 0
+        self.frame_allocs = 0
+
+    def begin_frame(self, size):
+        if size != self.size:
+            self.surfs.clear()
+            self.size = size
+        self.frame_allocs = 0
+
+    def new(self, size, flags=0):
+        self.allocs += 1
+        self.frame_allocs += 1
+        return pygame.Surface(size, flags)
+
+    def get(self, key, build):
+        s = self.surfs.get(key)
+        if s is None:
+            self.allocs += 1
+            self.frame_allocs += 1
+            s = self.surfs[key] = build()
+        return s
+
+    def filled(self, size, fill):
+        s = self.surfs.get((size, fill))
+        if s is None:
+            s = self.new(size, pygame.SRCALPHA if len(fill) == 4 else 0)
+            s.fill(fill)
+            self.surfs[(size, fill)] = s
+        return s
+
+class Panel:
+    # A retained SRCALPHA surface redrawn only when its key changes. The
+    # surface itself is reused; changed is True for the frame it was redrawn.
+    def __init__(self, surfaces):
+        self.surfaces = surfaces
+        self.surf = None
+        self.key = None
+        self.data = None
+        self.changed = False
+
+    def get(self, key, size, draw):
+        if self.surf is None or self.surf.get_size() != size:
+            self.surf = self.surfaces.new(size, pygame.SRCALPHA)
+            self.key = None
+        self.changed = key != self.key
+        if self.changed:
+            self.key = key
+            self.surf.fill((0, 0, 0, 0))
+            self.data = draw(self.surf)
+        return self.surf
+
+class TextCache:
+    # font.render results for short strings that repeat (gold, score, tower
+    # levels). Cleared wholesale once it holds `limit` entries.
+    def __init__(self, limit=512):
+        self.surfs = {}
+        self.limit = limit
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        s = self.surfs.get(key)
+        if s is None:
+            if len(self.surfs) >= self.limit:
+                self.surfs.clear()
+            s = self.surfs[key] = font.render(text, True, color)
+        return s
+
+class MapLayers:
+    # The map as both games draw it: the cached background, the tower range
+    # overlay, towers, enemies with health bars and bullets. Every map
+    # sprite, the bullet dot and a health bar for each whole pixel of fill
+    # go into one atlas, so each layer is drawn with a single blits().
+    # Enemies and bullets report where they were drawn to dirty.
+    BG = (40, 45, 35)
+    RED = (220, 50, 50)
+    GREEN = (50, 200, 80)
+    GOLD = (255, 215, 0)
+    WHITE = (255, 255, 255)
+    RANGE_COLORS = {
+        "bowman":   (80, 180, 80, 25),
+        "crossbow": (180, 100, 60, 25),
+        "guard":    (100, 180, 230, 30),
+    }
+
+    def __init__(self, screen, dirty, surfaces, text, font):
+        self.screen = screen
+        self.dirty = dirty
+        self.surfaces = surfaces
+        self.text = text
+        self.font = font
+        self.atlas = SpriteAtlas()
+        self.enemy_imgs = {}
+        self.tower_imgs = {}
+        self.shop_imgs = {}
+        self.castle_img = None
+        self.enemy_sprites = {}
+        self.tower_sprites = {}
+        self.bullet_sprite = None
+        self.range_layer = None
+        self.range_rect = None
+        self.range_key = None
+
+    def add_map_sprites(self, images):
+        atlas = self.atlas
+        self.tower_imgs.update(images["tower"])
+        self.shop_imgs.update(images["shop"])
+        self.castle_img = images["castle"]
+        for kind, img in self.tower_imgs.items():
+            atlas.add(("tower", kind), img)
+        atlas.add("castle", self.castle_img)
+        dot = atlas.blank((8, 8))
+        dot_rect = pygame.draw.circle(dot, (255, 255, 180), (4, 4), 3)
+        bullet = atlas.blank(dot_rect.size)
+        bullet.blit(dot, (0, 0), dot_rect)
+        atlas.add("bullet", bullet)
+        atlas.pack()
+        for kind, img in self.tower_imgs.items():
+            self.tower_sprites[kind] = (*atlas.sprites[("tower", kind)], img.get_width() // 2, img.get_height() // 2)
+        self.bullet_sprite = (*atlas.sprites["bullet"], dot_rect.x - 4, dot_rect.y - 4)
+
+    def add_enemy_sprites(self, images):
+        atlas = self.atlas
+        self.enemy_imgs.update(images["enemy"])
+        for kind, img in self.enemy_imgs.items():
+            atlas.add(("enemy", kind), img)
+            bw = max(img.get_width(), 20)
+            for fill in range(bw + 1):
+                bar = pygame.Surface((bw, 4)).convert()
+                bar.fill(self.RED)
+                bar.fill(self.GREEN, (0, 0, fill, 4))
+                atlas.add(("bar", kind, fill), bar)
+        atlas.pack()
+        for kind, img in self.enemy_imgs.items():
+            bw = max(img.get_width(), 20)
+            bars = [atlas.sprites[("bar", kind, fill)] for fill in range(bw + 1)]
+            self.enemy_sprites[kind] = (*atlas.sprites[("enemy", kind)], img.get_width() // 2, img.get_height() // 2, bw, bars)
+
+    def build_background(self, m):
+        bg = pygame.Surface(self.screen.get_size()).convert()
+        bg.fill(self.BG)
+        cell = m.cell
+        for c in range(m.cols + 1):
+            pygame.draw.line(bg, (55, 60, 50), (c * cell, 0), (c * cell, m.maph))
+        for r in range(m.rows + 1):
+            pygame.draw.line(bg, (55, 60, 50), (0, r * cell), (m.w, r * cell))
+        for c, r in m.path_cells:
+            rect = pygame.Rect(c * cell, r * cell, cell, cell)
+            pygame.draw.rect(bg, (170, 150, 100), rect)
+            pygame.draw.rect(bg, (140, 120, 75), rect, 1)
+        sx, sy = m.path[0]
+        pygame.draw.circle(bg, self.GREEN, (sx + 10, sy), 10)
+        bg.blit(self.font.render("START", True, self.WHITE), (sx + 24, sy - 8))
+        ex, ey = m.path[-1]
+        src, rect = self.atlas.sprites["castle"]
+        img = self.castle_img
+        bg.blit(src, (ex - img.get_width() - 4, ey - img.get_height() // 2), rect)
+        return bg
+
+    def draw_background(self, m):
+        bg = self.surfaces.get(("bg", m.route.points), lambda: self.build_background(m))
+        self.screen.blit(bg, (0, 0))
+
+    def range_surface(self, kind, rng):
+        def build():
+            rc = self.RANGE_COLORS[kind]
+            s = pygame.Surface((rng * 2, rng * 2), pygame.SRCALPHA)
+            s.fill(rc)
+            pygame.draw.rect(s, (*rc[:3], 60), s.get_rect(), 1)
+            return s.premul_alpha()
+        return self.surfaces.get(("range", kind, rng), build)
+
+    def draw_ranges(self, game, selected, show):
+        # All range overlays composited (premultiplied) into one layer that
+        # is only rebuilt when the layout, selection or view mode changes.
+        # The layer only covers the union of the shown ranges.
+        size = self.screen.get_size()
+        key = (game.layout_version, selected, show, size)
+        if key != self.range_key:
+            self.range_key = key
+            self.dirty.invalidate()
+            shown = game.towers if show == "all" else [selected] if selected else []
+            self.range_layer = None
+            rects = [pygame.Rect(int(t.x) - t.rng, int(t.y) - t.rng, t.rng * 2, t.rng * 2) for t in shown]
+            area = rects[0].unionall(rects[1:]).clip(self.screen.get_rect()) if rects else None
+            if area:
+                self.range_rect = area
+                self.range_layer = self.surfaces.new(area.size, pygame.SRCALPHA)
+                for t, r in zip(shown, rects):
+                    self.range_layer.blit(self.range_surface(t.kind, t.rng), (r.x - area.x, r.y - area.y),
+                                          special_flags=pygame.BLEND_PREMULTIPLIED)
+        if self.range_layer:
+            self.screen.blit(self.range_layer, self.range_rect.topleft, special_flags=pygame.BLEND_PREMULTIPLIED)
+
+    def draw_towers(self, towers, selected):
+        sprites = self.tower_sprites
+        batch = []
+        for t in towers:
+            src, rect, hw, hh = sprites[t.kind]
+            ix = int(t.x)
+            iy = int(t.y)
+            batch.append((src, (ix - hw, iy - hh), rect))
+            if t.lv > 1:
+                batch.append((self.text.render(self.font, str(t.lv), self.GOLD), (ix + hw - 4, iy - hh - 2)))
+        self.screen.blits(batch, doreturn=0)
+        if selected:
+            r = sprites[selected.kind][2] + 3
+            pygame.draw.circle(self.screen, self.WHITE, (int(selected.x), int(selected.y)), r, 2)
+
+    def draw_enemies(self, enemies, a):
+        sprites = self.enemy_sprites
+        batch = []
+        for e in enemies:
+            ix = int(e.px + (e.x - e.px) * a)
+            iy = int(e.py + (e.y - e.py) * a)
+            src, rect, hw, hh, bw, bars = sprites[e.kind]
+            batch.append((src, (ix - hw, iy - hh), rect))
+            fill = min(bw, max(0, int(bw * e.hp / e.max_hp)))
+            bar_src, bar_rect = bars[fill]
+            batch.append((bar_src, (ix - bw // 2, iy - hh - 6), bar_rect))
+        self.dirty.extend(self.screen.blits(batch))
+
+    def draw_enemy_columns(self, cols, a):
+        # draw_enemies() for ArraySim.enemy_columns(), without a row object
+        # per enemy.
+        sprites = self.enemy_sprites
+        batch = []
+        for kind, x, y, px, py, hp, mhp in zip(*cols):
+            ix = int(px + (x - px) * a)
+            iy = int(py + (y - py) * a)
+            src, rect, hw, hh, bw, bars = sprites[kind]
+            batch.append((src, (ix - hw, iy - hh), rect))
+            fill = min(bw, max(0, int(bw * hp / mhp)))
+            bar_src, bar_rect = bars[fill]
+            batch.append((bar_src, (ix - bw // 2, iy - hh - 6), bar_rect))
+        self.dirty.extend(self.screen.blits(batch))
+
+    def draw_bullets(self, bullets, a):
+        src, rect, ox, oy = self.bullet_sprite
+        self.dirty.extend(self.screen.blits([(src, (int(b.px + (b.x - b.px) * a) + ox, int(b.py + (b.y - b.py) * a) + oy), rect)
+                                             for b in bullets]))
+
+class DirtyRects:
+    # Presents only the parts of the screen that changed. Sprites report
+    # where they were drawn; last frame's rects are repainted too so moved
+    # or removed sprites get cleaned up. Anything that changes a static
+    # layer calls invalidate(), and when the dirty area exceeds max_share
+    # of the screen a plain flip is cheaper.
+    def __init__(self, max_share=0.35):
+        self.max_share = max_share
+        self.rects = []
+        self.prev = []
+        self.full = True
+        self.last_count = 0
+
+    def add(self, rect):
+        self.rects.append(rect)
+
+    def extend(self, rects):
+        self.rects.extend(rects)
+
+    def invalidate(self):
+        self.full = True
+
+    def present(self, size):
+        rects = self.prev + self.rects
+        area = sum(r.w * r.h for r in rects)
+        if self.full or area > self.max_share * size[0] * size[1]:
+            pygame.display.flip()
+            self.last_count = 0
+        else:
+            pygame.display.update(rects)
+            self.last_count = len(rects)
+        self.prev = self.rects
+        self.rects = []
+        self.full = False
+
+class Upscaler(DirtyRects):
+    # Presents a fixed-size render target on a bigger display. The game
+    # draws into surf at its internal resolution and present() scales it
+    # once, keeping the aspect ratio and letterboxing the rest. "fit" fills
+    # as much of the display as it can and smoothscales the whole frame
+    # whenever anything changed; "integer" uses the largest whole factor
+    # (nearest neighbour, crisp pixels), which maps dirty rects exactly, so
+    # only the changed parts are scaled. A fit that comes out whole takes
+    # the integer path too.
+    def __init__(self, surf, display, mode="fit", max_share=0.35):
+        super().__init__(max_share)
+        self.surf = surf
+        self.display = display
+        w, h = surf.get_size()
+        dw, dh = display.get_size()
+        fit = min(dw / w, dh / h)
+        whole = min(dw // w, dh // h)
+        self.integer = whole >= 1 and (mode == "integer" or fit == whole)
+        self.k = k = whole if self.integer else fit
+        self.rect = pygame.Rect(0, 0, round(w * k), round(h * k))
+        self.rect.center = (dw // 2, dh // 2)
+        self.target = display.subsurface(self.rect)
+        display.fill((0, 0, 0))
+
+    def to_internal(self, pos):
+        # Display to render-target coordinates; None outside the picture.
+        if not self.rect.collidepoint(pos):
+            return None
+        w, h = self.surf.get_size()
+        return (pos[0] - self.rect.x) * w // self.rect.w, (pos[1] - self.rect.y) * h // self.rect.h
+
+    def present(self, size):
+        rects = self.prev + self.rects
+        if self.full or (rects and not self.integer):
+            # smoothscale's sampling grid only repeats across the whole
+            # width, so no part of a fit frame can be rescaled on its own
+            # and match the rest; fit mode presents whole frames.
+            self.present_full()
+        elif rects:
+            self.present_integer(rects, size)
+        else:
+            # Nothing changed since the last present.
+            self.last_count = 0
+        self.prev = self.rects
+        self.rects = []
+        self.full = False
+
+    def present_full(self):
+        if self.k == 1:
+            self.target.blit(self.surf, (0, 0))
+        elif self.integer:
+            pygame.transform.scale(self.surf, self.rect.size, self.target)
+        else:
+            pygame.transform.smoothscale(self.surf, self.rect.size, self.target)
+        pygame.display.flip()
+        self.last_count = 0
+
+    def present_integer(self, rects, size):
+        area = sum(r.w * r.h for r in rects)
+        if area > self.max_share * size[0] * size[1]:
+            self.present_full()
+        else:
+            k = self.k
+            bounds = self.surf.get_rect()
+            out = []
+            for r in rects:
+                r = r.clip(bounds)
+                if r.w and r.h:
+                    dst = pygame.Rect(r.x * k, r.y * k, r.w * k, r.h * k)
+                    pygame.transform.scale(self.surf.subsurface(r), dst.size, self.target.subsurface(dst))
+                    out.append(dst.move(self.rect.topleft))
+            pygame.display.update(out)
+            self.last_count = len(out)
+
+class FramePacer:
+    # Frame pacing for the browser build, where the page's animation frames
+    # set the rate: the loop never sleeps, it yields once per frame and
+    # tick() measures the real interval. A frame that arrives late (over
+    # `late` times the target) is followed by up to max_skip frames that
+    # only run the sim's catch-up ticks and skip drawing; past the stepper's
+    # own tick cap the time is dropped, so a slow device slows down instead
+    # of spiralling. draw() shows the stats.
+    def __init__(self, target=1000 / 60, late=1.5, max_skip=2, history=120):
+        self.target = target
+        self.late = late
+        self.max_skip = max_skip
+        self.history = deque(maxlen=history)
+        self.run = 0
+        self.skipped = 0
+        self.t = time.perf_counter()
+        self.on = False
+        self.surf = None
+
+    def tick(self):
+        now = time.perf_counter()
+        ms = (now - self.t) * 1000
+        self.t = now
+        return ms
+
+    def frame(self, ms, ticks, skip=True):
+        # Records the frame; returns whether it should be drawn.
+        draw = not (skip and ms > self.target * self.late and self.run < self.max_skip)
+        self.run = 0 if draw else self.run + 1
+        self.skipped += not draw
+        self.history.append((ms, ticks, draw))
+        return draw
+
+    def draw(self, surf, font, pos, stepper):
+        if not self.history:
+            return None
+        ms = sorted(h[0] for h in self.history)
+        n = len(ms)
+        secs = sum(ms) / 1000 or 1
+        drawn = sum(h[2] for h in self.history)
+        lines = [
+            f"fps {n / secs:.1f}  drawn {drawn / secs:.1f}",
+            f"frame ms avg {sum(ms) / n:.1f}  p95 {ms[min(n - 1, int(n * 0.95))]:.1f}  max {ms[-1]:.1f}",
+            f"ticks/frame {sum(h[1] for h in self.history) / n:.2f}  x{stepper.speed}",
+            f"skipped {self.skipped}  dropped ticks {stepper.dropped}",
+        ]
+        lh = font.get_linesize()
+        size = (300, lh * len(lines) + 8)
+        if self.surf is None or self.surf.get_size() != size:
+            self.surf = pygame.Surface(size, pygame.SRCALPHA)
+        self.surf.fill((0, 0, 0, 170))
+        for i, line in enumerate(lines):
+            self.surf.blit(font.render(line, True, (220, 220, 220)), (6, 4 + i * lh))
+        return surf.blit(self.surf, pos)
+
+class FrameProfiler:
+    # Per-phase frame timings. mark(phase) charges the time since the last
+    # mark to that phase; Sim.step marks its own phases when it is handed
+    # the profiler. Everything is a no-op while it is off. Samples taken
+    # while on are written to a CSV when it is switched off.
+    PHASES = ("events", "spawn", "move", "target", "bullets",
+              "background", "entities", "hud", "present")
+
+    def __init__(self, history=120, window=60):
+        self.on = False
+        self.history = deque(maxlen=history)
+        self.window = window
+        self.samples = []
+        self.frame = None
+        self.t = 0.0
+        self.surf = None
+
+    def toggle(self, game):
+        self.on = not self.on
+        game.profile = self if self.on else None
+        if self.on:
+            self.history.clear()
+            self.samples = []
+            self.begin()
+            return None
+        return self.save() if self.samples else None
+
+    def begin(self):
+        if self.on:
+            self.frame = dict.fromkeys(self.PHASES, 0.0)
+            self.t = time.perf_counter()
+
+    def mark(self, phase):
+        if self.on:
+            now = time.perf_counter()
+            self.frame[phase] += (now - self.t) * 1000
+            self.t = now
+
+    def end(self, game):
+        if not self.on:
+            return
+        row = tuple(self.frame[p] for p in self.PHASES)
+        self.history.append(row)
+        self.samples.append((len(self.samples), game.tick, game.enemy_count(), len(game.bullets)) + row)
+
+    def save(self, path=None):
+        path = path or time.strftime("profile-%Y%m%d-%H%M%S.csv")
+        with open(path, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(("frame", "tick", "n_enemies", "n_bullets") + self.PHASES + ("total",))
+            for s in self.samples:
+                w.writerow(s[:4] + tuple(f"{v:.3f}" for v in s[4:]) + (f"{sum(s[4:]):.3f}",))
+        return path
+
+    def draw(self, surf, font, pos, budget=1000 / 60):
+        # Rolling averages per phase and a graph of recent frame totals
+        # against the frame budget.
+        if not self.history:
+            return None
+        lh = font.get_linesize()
+        w, gh = 240, 50
+        h = lh * (len(self.PHASES) + 1) + gh + 12
+        if self.surf is None or self.surf.get_size() != (w, h):
+            self.surf = pygame.Surface((w, h), pygame.SRCALPHA)
+        s = self.surf
+        s.fill((0, 0, 0, 170))
+        recent = list(self.history)[-self.window:]
+        n = len(recent)
+        totals = [sum(r) for r in self.history]
+        rows = [(p, sum(r[i] for r in recent) / n, (220, 220, 220)) for i, p in enumerate(self.PHASES)]
+        rows.append(("frame", sum(totals[-n:]) / n, (255, 215, 0)))
+        for i, (name, avg, col) in enumerate(rows):
+            s.blit(font.render(name, True, col), (6, 4 + i * lh))
+            value = font.render(f"{avg:.2f} ms", True, col)
+            s.blit(value, (150 - value.get_width(), 4 + i * lh))
+        s.blit(font.render(f"max {max(totals[-n:]):.1f}", True, (255, 215, 0)), (160, 4 + len(self.PHASES) * lh))
+        gy = h - gh - 4
+        scale = gh / (budget * 2)
+        line = gy + gh - int(budget * scale)
+        x0 = w - 4 - 2 * len(totals)
+        for i, t in enumerate(totals):
+            bar = min(gh, int(t * scale))
+            col = (220, 50, 50) if t > budget else (80, 200, 100)
+            s.fill(col, (x0 + 2 * i, gy + gh - bar, 2, bar))
+        pygame.draw.line(s, (255, 255, 255), (4, line), (w - 5, line))
+        return surf.blit(s, pos)
@@ -0,0 +1,199 @@
+import io, pickle, sys, time, zlib
+from collections import deque
+
+from sim import Sim
+
+# In-memory rewind. Rewind keeps a ring buffer of Sim.snapshot()s taken
+# every few ticks during a wave, plus the build-phase state from just
+# before the current wave started, and can put the game back to any of
+# them at once.
+#
+# Each section of a snapshot (core counters, rng, towers, enemies, bullets,
+# spawns) is pickled and stored as nothing when it is unchanged since the
+# previous snapshot, XORed against the previous bytes when the size
+# matches, or whole; zlib compresses the last two. Every keyframe-th
+# snapshot is stored whole, so rebuilding any of them decodes at most
+# keyframe snapshots.
+#
+#   python rewind.py     plays a scripted game and reports the capture cost
+#                        per tick against the budget; exits 1 if over
+
+def xor(a, b):
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+def dumps(value):
+    # Without the memo, equal values always pickle to equal bytes, whichever
+    # objects they are made of; that is what the deltas compare.
+    f = io.BytesIO()
+    p = pickle.Pickler(f, 5)
+    p.fast = True
+    p.dump(value)
+    return f.getvalue()
+
+def pack(snap):
+    return {name: dumps(value) for name, value in snap.items()}
+
+def unpack(raw):
+    return {name: pickle.loads(data) for name, data in raw.items()}
+
+class Rewind:
+    # update() is called after the frame's sim ticks and takes a snapshot
+    # when one is due. Capture time is averaged; while it costs more than
+    # budget_ms per tick, snapshots are taken less often (up to 8x), and
+    # the interval comes back down once there is room again.
+    def __init__(self, every=30, capacity=120, keyframe=10, budget_ms=0.05):
+        self.base_every = every
+        self.capacity = capacity
+        self.keyframe = keyframe
+        self.budget_ms = budget_ms
+        self.clear()
+
+    def clear(self):
+        self.snaps = deque()
+        self.prev = None
+        self.since_key = 0
+        self.wave = None
+        self.every = self.base_every
+        self.next_tick = 0
+        self.cost_ms = None
+
+    def encode(self, raw, key):
+        out = {}
+        for name, data in raw.items():
+            old = None if key else self.prev[name]
+            if old == data:
+                out[name] = None
+            elif old is not None and len(old) == len(data):
+                out[name] = (True, zlib.compress(xor(data, old), 1))
+            else:
+                out[name] = (False, zlib.compress(data, 1))
+        return out
+
+    def decode(self, i):
+        # Raw section bytes of snapshot i, from the keyframe at or before it.
+        j = i
+        while not self.snaps[j][1]:
+            j -= 1
+        raw = {}
+        for k in range(j, i + 1):
+            for name, enc in self.snaps[k][2].items():
+                if enc is None:
+                    continue
+                delta, data = enc
+                data = zlib.decompress(data)
+                raw[name] = xor(data, raw[name]) if delta else data
+        return raw
+
+    def capture(self, game):
+        t0 = time.perf_counter()
+        raw = pack(game.snapshot())
+        key = self.prev is None or self.since_key >= self.keyframe - 1
+        self.snaps.append((game.tick, key, self.encode(raw, key)))
+        self.since_key = 0 if key else self.since_key + 1
+        self.prev = raw
+        if len(self.snaps) > self.capacity:
+            # The oldest snapshot is a keyframe; the one after it becomes one.
+            nxt = self.decode(1)
+            self.snaps.popleft()
+            tick, key, _ = self.snaps[0]
+            if not key:
+                self.snaps[0] = (tick, True, {n: (False, zlib.compress(d, 1)) for n, d in nxt.items()})
+
+        ms = (time.perf_counter() - t0) * 1000
+        self.cost_ms = ms if self.cost_ms is None else self.cost_ms * 0.8 + ms * 0.2
+        per_tick = self.cost_ms / self.every
+        if per_tick > self.budget_ms and self.every < self.base_every * 8:
+            self.every *= 2
+        elif per_tick < self.budget_ms / 4 and self.every > self.base_every:
+            self.every //= 2
+
+    def update(self, game):
+        if game.state == "wave" and game.tick >= self.next_tick:
+            self.capture(game)
+            self.next_tick = game.tick + self.every
+
+    def mark_wave(self, game):
+        # Sim.on_wave_start; to_wave() comes back here.
+        self.wave = zlib.compress(dumps(game.snapshot()), 1)
+
+    def ticks(self):
+        return [s[0] for s in self.snaps]
+
+    def truncate(self, tick):
+        # Forgets the snapshots after tick; the next one is encoded against
+        # the newest that is left.
+        while self.snaps and self.snaps[-1][0] > tick:
+            self.snaps.pop()
+        self.prev = self.decode(len(self.snaps) - 1) if self.snaps else None
+        self.since_key = 0
+        while self.snaps and not self.snaps[-1 - self.since_key][1]:
+            self.since_key += 1
+        self.next_tick = tick + self.every
+
+    def restore(self, game, i):
+        # Rewinds to buffered snapshot i and forgets the ones after it.
+        game.restore(unpack(self.decode(i)))
+        self.truncate(game.tick)
+
+    def back(self, game):
+        # Rewinds to the newest snapshot older than the current tick.
+        i = len(self.snaps) - 1
+        while i >= 0 and self.snaps[i][0] >= game.tick:
+            i -= 1
+        if i < 0:
+            return False
+        self.restore(game, i)
+        return True
+
+    def to_wave(self, game):
+        if self.wave is None:
+            return False
+        game.restore(pickle.loads(zlib.decompress(self.wave)))
+        self.truncate(game.tick)
+        return True
+
+    def size(self):
+        n = len(self.wave or b"")
+        for _, _, enc in self.snaps:
+            n += sum(len(e[1]) for e in enc.values() if e)
+        return n
+
+def main(argv):
+    # A long endless run with a full map: the worst case for snapshot size.
+    game = Sim(seed=1)
+    game.gold = 10 ** 9
+    game.lives = 10 ** 9
+    kinds = ["bowman", "crossbow", "bowman", "guard"]
+    n = 0
+    for col in range(game.map.cols):
+        for row in range(game.map.rows):
+            if game.can_place(col, row) and any((col + dc, row + dr) in game.map.path_cells
+                                                for dc in (-1, 0, 1) for dr in (-1, 0, 1)):
+                game.place(kinds[n % len(kinds)], col, row)
+                n += 1
+    rw = Rewind()
+    game.on_wave_start = rw.mark_wave
+    game.wave_num = 30
+    game.start_wave()
+    ticks = 0
+    spent = 0.0
+    for _ in range(20000):
+        if game.state != "wave":
+            game.start_wave()
+        game.step()
+        t0 = time.perf_counter()
+        rw.update(game)
+        spent += time.perf_counter() - t0
+        ticks += 1
+    per_tick = spent * 1000 / ticks
+    raw = sum(len(d) for d in pack(game.snapshot()).values())
+    print(f"{ticks} ticks  {len(rw.snaps)} snapshots every {rw.every} ticks  "
+          f"{rw.size() / 1024:.0f} KB buffered ({raw / 1024:.1f} KB per raw snapshot)")
+    print(f"capture {per_tick:.4f} ms per tick, budget {rw.budget_ms} ms")
+    if per_tick > rw.budget_ms:
+        print("OVER BUDGET")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,800 @@
+import heapq, math, random
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+
+# Display-free game core shared by main.py, china_game.py and the tools.
+# Nothing in here imports pygame, so whole games can be simulated headless.
+
+CELL = 64
+
+WAYPOINTS = [
+    (0.0, 0.50), (0.30, 0.50), (0.30, 0.15),
+    (0.65, 0.15), (0.65, 0.75), (0.95, 0.75),
+]
+
+ENEMIES = {
+    "barbarian": {"hp": 40,   "speed": 2.5, "reward": 10,   "leak": 1},
+    "raider":    {"hp": 70,   "speed": 3.5, "reward": 15,  "leak": 2},
+    "shield":    {"hp": 180,  "speed": 2.5, "reward": 20,  "leak": 3},
+    "siege":     {"hp": 400,  "speed": 1.8, "reward": 35,  "leak": 5},
+    "general":   {"hp": 900,  "speed": 2.2, "reward": 120, "leak": 8},
+}
+
+TOWERS = {
+    "bowman": {
+        "name": "Bowman", "cost": 40, "rng": CELL * 2 + CELL // 2, "dmg": 18, "rate": 30,
+        "col": (80, 180, 80), "upg_cost": 30,
+        "desc": "Fast, Single Target",
+    },
+    "crossbow": {
+        "name": "Crossbow", "cost": 90, "rng": CELL * 1 + CELL // 2, "dmg": 50, "rate": 55,
+        "col": (180, 100, 60), "upg_cost": 50, "splash": 50,
+        "desc": "Slower, Splash Damage",
+    },
+    "guard": {
+        "name": "Guard", "cost": 60, "rng": CELL * 2 + CELL // 2, "dmg": 10, "rate": 35,
+        "col": (100, 180, 230), "upg_cost": 40, "slow": 0.45,
+        "desc": "Slows all enemies in range",
+    },
+}
+
+WAVES = [
+    [("barbarian", 6, 18)],
+    [("barbarian", 10, 15)],
+    [("barbarian", 8, 14), ("raider", 3, 20)],
+    [("raider", 6, 16), ("barbarian", 8, 12)],
+    [("shield", 3, 25), ("barbarian", 10, 12)],
+    [("raider", 8, 14), ("shield", 4, 22), ("general", 1, 0)],
+    [("barbarian", 12, 10), ("raider", 6, 14), ("shield", 4, 20)],
+    [("raider", 10, 12), ("shield", 5, 18), ("siege", 2, 30)],
+    [("barbarian", 15, 8), ("shield", 6, 16), ("siege", 3, 25)],
+    [("raider", 12, 10), ("siege", 4, 22), ("shield", 5, 16)],
+    [("shield", 8, 14), ("siege", 5, 20), ("general", 1, 0)],
+    [("raider", 15, 8), ("siege", 6, 18), ("shield", 8, 12), ("general", 2, 0)],
+]
+
+MAX_LIVES = 20
+START_GOLD = 200
+MAX_LEVEL = 5
+TARGETING = ["first", "last", "strongest", "closest"]
+HP_GROWTH = 0.15
+
+class Path:
+    # PATH compiled to a cumulative arc-length table; enemies store a single
+    # distance along it and positions come from a bisect plus one lerp.
+    def __init__(self, points):
+        self.points = tuple(points)
+        self.cum = [0.0]
+        self.segs = []
+        self.lens = []
+        for a, b in zip(self.points, self.points[1:]):
+            length = math.hypot(b[0] - a[0], b[1] - a[1])
+            n = length or 1
+            self.segs.append((a[0], a[1], (b[0] - a[0]) / n, (b[1] - a[1]) / n))
+            self.lens.append(n)
+            self.cum.append(self.cum[-1] + length)
+        self.length = self.cum[-1]
+        self.last = len(self.segs) - 1
+
+    def pos(self, d):
+        i = min(bisect_right(self.cum, d) - 1, self.last)
+        ax, ay, ux, uy = self.segs[i]
+        d -= self.cum[i]
+        return ax + ux * d, ay + uy * d
+
+    def advance(self, d, step):
+        # Moves d on by step the way enemies have always walked: the step is
+        # taken as a fraction of the segment they are on, and whatever runs
+        # past a corner carries on as that fraction of the next segment.
+        # Returns length once they run off the end.
+        i = min(bisect_right(self.cum, d) - 1, self.last)
+        t = (d - self.cum[i] + step) / self.lens[i]
+        while t >= 1:
+            t -= 1
+            i += 1
+            if i > self.last:
+                return self.length
+        return self.cum[i] + t * self.lens[i]
+
+    def coverage(self, x, y, r):
+        # Distance intervals [d0, d1] along the path that lie inside the
+        # Chebyshev square of radius r around (x, y), merged where they touch.
+        spans = []
+        for i, (ax, ay, ux, uy) in enumerate(self.segs):
+            lo = 0.0
+            hi = self.cum[i + 1] - self.cum[i]
+            for p, u, c in ((ax, ux, x), (ay, uy, y)):
+                if u == 0:
+                    if abs(p - c) > r:
+                        hi = -1.0
+                    continue
+                s0 = (c - r - p) / u
+                s1 = (c + r - p) / u
+                if s0 > s1:
+                    s0, s1 = s1, s0
+                lo = max(lo, s0)
+                hi = min(hi, s1)
+            if lo > hi:
+                continue
+            d0 = self.cum[i] + lo
+            d1 = self.cum[i] + hi
+            if spans and d0 <= spans[-1][1]:
+                spans[-1] = (spans[-1][0], max(spans[-1][1], d1))
+            else:
+                spans.append((d0, d1))
+        return spans
+
+class SlowMap:
+    # Piecewise-constant speed factor along the path: the strongest guard
+    # slow covering each stretch. factor(d) is a bisect over the breakpoints.
+    def __init__(self, spans):
+        pts = sorted({p for d0, d1, f in spans for p in (d0, d1)})
+        self.breaks = []
+        self.factors = []
+        for a, b in zip(pts, pts[1:] + [math.inf]):
+            mid = (a + b) / 2 if b != math.inf else a + 1
+            f = min([s for d0, d1, s in spans if d0 <= mid <= d1] or [1.0])
+            if not self.factors or self.factors[-1] != f:
+                self.breaks.append(a)
+                self.factors.append(f)
+
+    def factor(self, d):
+        i = bisect_right(self.breaks, d) - 1
+        return self.factors[i] if i >= 0 else 1.0
+
+_paths = {}
+
+def compile_path(points):
+    key = tuple(points)
+    p = _paths.get(key)
+    if p is None:
+        p = _paths[key] = Path(key)
+    return p
+
+class Map:
+    def __init__(self, w, maph, cell=CELL, waypoints=WAYPOINTS):
+        self.w = w
+        self.maph = maph
+        self.cell = cell
+        self.cols = w // cell
+        self.rows = maph // cell
+
+        self.path_grid = []
+        for px, py in waypoints:
+            c = max(0, min(self.cols - 1, round(px * (self.cols - 1))))
+            r = max(0, min(self.rows - 1, round(py * (self.rows - 1))))
+            self.path_grid.append((c, r))
+
+        self.path_cells = set()
+        for i in range(len(self.path_grid) - 1):
+            c1, r1 = self.path_grid[i]
+            c2, r2 = self.path_grid[i + 1]
+            if r1 == r2:
+                for c in range(min(c1, c2), max(c1, c2) + 1):
+                    self.path_cells.add((c, r1))
+            else:
+                for r in range(min(r1, r2), max(r1, r2) + 1):
+                    self.path_cells.add((c1, r))
+
+        self.path = []
+        for c, r in self.path_grid:
+            self.path.append((c * cell + cell // 2, r * cell + cell // 2))
+        self.path[0] = (0, self.path[0][1])
+        self.path[-1] = (w, self.path[-1][1])
+        self.route = compile_path(self.path)
+
+    def snap(self, px, py):
+        col = max(0, min(self.cols - 1, px // self.cell))
+        row = max(0, min(self.rows - 1, py // self.cell))
+        return col * self.cell + self.cell // 2, row * self.cell + self.cell // 2, col, row
+
+class SpatialHash:
+    # Alive enemies bucketed by the CELL grid, rebuilt once per tick after
+    # movement. Range and splash queries only visit the overlapping buckets.
+    def __init__(self, cell=CELL):
+        self.cell = cell
+        self.buckets = {}
+
+    def rebuild(self, enemies):
+        cell = self.cell
+        buckets = self.buckets = {}
+        for e in enemies:
+            if not e.alive:
+                continue
+            key = (int(e.x // cell), int(e.y // cell))
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [e]
+            else:
+                b.append(e)
+
+    def query(self, x, y, r):
+        cell = self.cell
+        buckets = self.buckets
+        found = []
+        if not buckets:
+            return found
+        c0 = int((x - r) // cell)
+        c1 = int((x + r) // cell)
+        r0 = int((y - r) // cell)
+        r1 = int((y + r) // cell)
+        for c in range(c0, c1 + 1):
+            for rr in range(r0, r1 + 1):
+                b = buckets.get((c, rr))
+                if b:
+                    found.extend(b)
+        return found
+
+class Enemy:
+    __slots__ = ("kind", "max_hp", "hp", "base_speed", "speed", "reward", "leak_dmg",
+                 "route", "dist", "x", "y", "px", "py", "alive", "leaked")
+
+    def __init__(self, kind, data, route, hp_scale=1.0):
+        self.setup(kind, data, route, hp_scale)
+
+    def setup(self, kind, data, route, hp_scale=1.0):
+        self.kind = kind
+        self.max_hp = int(data["hp"] * hp_scale)
+        self.hp = self.max_hp
+        self.base_speed = data["speed"]
+        self.speed = data["speed"]
+        self.reward = data["reward"]
+        self.leak_dmg = data["leak"]
+        self.route = route
+        self.dist = 0.0
+        self.x, self.y = (float(v) for v in route.points[0])
+        self.px, self.py = self.x, self.y
+        self.alive = True
+        self.leaked = False
+
+    def update(self):
+        if not self.alive:
+            return
+        self.px, self.py = self.x, self.y
+        self.dist = self.route.advance(self.dist, self.speed)
+        if self.dist >= self.route.length:
+            self.alive = False
+            self.leaked = True
+            return
+        self.x, self.y = self.route.pos(self.dist)
+
+    def progress(self):
+        return self.dist
+
+class Tower:
+    __slots__ = ("kind", "data", "x", "y", "col", "row", "lv", "dmg", "rng", "rate",
+                 "splash", "slow", "target", "cd", "cover")
+
+    def __init__(self, kind, data, x, y, col=0, row=0):
+        self.kind = kind
+        self.data = data
+        self.x = x
+        self.y = y
+        self.col = col
+        self.row = row
+        self.lv = 1
+        self.dmg = data["dmg"]
+        self.rng = data["rng"]
+        self.rate = data["rate"]
+        self.splash = data.get("splash", 0)
+        self.slow = data.get("slow", 0)
+        self.target = "first"
+        self.cd = 0
+        self.cover = []
+
+    def upg_cost(self):
+        return self.data["upg_cost"] + 20 * (self.lv - 1)
+
+    def upgrade(self):
+        self.lv += 1
+        if self.slow:
+            self.rng += CELL
+            self.slow = max(0.15, self.slow - 0.06)
+        else:
+            self.dmg += 10
+            self.rng += CELL
+            self.rate = max(10, self.rate - 4)
+
+    def cycle_target(self):
+        self.target = TARGETING[(TARGETING.index(self.target) + 1) % len(TARGETING)]
+
+    def pick(self, order, dists):
+        # order holds the alive enemies sorted by path distance and dists
+        # their distances, so each coverage interval is a bisect range.
+        cover = self.cover
+        if self.target == "first":
+            for d0, d1 in reversed(cover):
+                i = bisect_right(dists, d1) - 1
+                if i >= 0 and dists[i] >= d0:
+                    return order[i]
+            return None
+        if self.target == "last":
+            for d0, d1 in cover:
+                i = bisect_left(dists, d0)
+                if i < len(dists) and dists[i] <= d1:
+                    return order[i]
+            return None
+        cands = []
+        for d0, d1 in cover:
+            cands += order[bisect_left(dists, d0):bisect_right(dists, d1)]
+        if not cands:
+            return None
+        if self.target == "strongest":
+            return max(cands, key=lambda e: (e.hp, e.dist))
+        x, y = self.x, self.y
+        return min(cands, key=lambda e: (e.x - x) ** 2 + (e.y - y) ** 2)
+
+    def update(self, order, dists):
+        # Returns the enemy to shoot at this tick, if any. Guards do nothing
+        # here; their slow is baked into the Sim's SlowMap.
+        if self.slow:
+            return None
+        self.cd = max(0, self.cd - 1)
+        if self.cd > 0:
+            return None
+        target = self.pick(order, dists)
+        if target:
+            self.cd = self.rate
+        return target
+
+class Bullet:
+    __slots__ = ("x", "y", "px", "py", "target", "dmg", "splash", "alive")
+
+    def __init__(self, x, y, target, dmg, splash=0):
+        self.setup(x, y, target, dmg, splash)
+
+    def setup(self, x, y, target, dmg, splash=0):
+        self.x = self.px = float(x)
+        self.y = self.py = float(y)
+        self.target = target
+        self.dmg = dmg
+        self.splash = splash
+        self.alive = True
+
+    def update(self, index):
+        if not self.target.alive:
+            self.alive = False
+            return
+        self.px, self.py = self.x, self.y
+        dx = self.target.x - self.x
+        dy = self.target.y - self.y
+        dist = math.hypot(dx, dy)
+        if dist < 8:
+            if self.splash > 0:
+                tx, ty = self.target.x, self.target.y
+                for e in index.query(tx, ty, self.splash):
+                    if e.alive and math.hypot(e.x - tx, e.y - ty) < self.splash:
+                        e.hp -= self.dmg
+                        if e.hp <= 0:
+                            e.alive = False
+            else:
+                self.target.hp -= self.dmg
+                if self.target.hp <= 0:
+                    self.target.alive = False
+            self.alive = False
+            return
+        self.x += dx / dist * 9
+        self.y += dy / dist * 9
+
+def wave_groups(wave_idx, waves=WAVES, rng=random):
+    # The wave's (kind, count, delay[, start]) groups. Past the end of waves
+    # they are rolled here, once per wave; the enemies themselves are only
+    # produced as they come due.
+    if wave_idx < len(waves):
+        return waves[wave_idx]
+    defs = [
+        (rng.choice(["barbarian", "raider", "shield"]), 10 + wave_idx, rng.randint(12, 25)),
+        ("siege", wave_idx // 3, 40),
+    ]
+    if wave_idx % 5 == 0:
+        defs.append(("general", 1, 0))
+    return defs
+
+class SpawnStream:
+    # Lazily walks groups back to back: yields (kind, gap), where gap is the
+    # number of ticks until the next spawn of this stream (at least 1).
+    def __init__(self, groups):
+        self.groups = groups
+        self.g = 0
+        self.n = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.g < len(self.groups):
+            kind, count, delay = self.groups[self.g][:3]
+            if self.n < count:
+                self.n += 1
+                return kind, max(delay, 1)
+            self.g += 1
+            self.n = 0
+        raise StopIteration
+
+class SpawnTimeline:
+    # A wave's spawns keyed by tick. Groups without a start offset follow
+    # one another in a single stream, as in the original wave tables; a
+    # group with a fourth field starts that many ticks into the wave on its
+    # own stream, so it overlaps the others. Each stream only ever has its
+    # next spawn on the heap, so scheduling is O(log streams) and nothing
+    # is materialised up front.
+    def __init__(self):
+        self.heap = []
+
+    def __bool__(self):
+        return bool(self.heap)
+
+    def start(self, tick, groups, hp_scale):
+        # The first spawn lands on the first step after tick.
+        self.heap = []
+        chain = [g for g in groups if len(g) < 4]
+        streams = [(0, chain)] + [(g[3], [g]) for g in groups if len(g) >= 4]
+        for seq, (offset, gs) in enumerate(streams):
+            self.push(tick + 1 + offset, seq, SpawnStream(gs), hp_scale)
+
+    def push(self, due, seq, stream, hp_scale):
+        item = next(stream, None)
+        if item:
+            heapq.heappush(self.heap, (due, seq, item[0], item[1], hp_scale, stream))
+
+    def snapshot(self):
+        # The heap as plain tuples, in heap order.
+        return tuple((due, seq, kind, gap, hp_scale, stream.groups, stream.g, stream.n)
+                     for due, seq, kind, gap, hp_scale, stream in self.heap)
+
+    def restore(self, snap):
+        self.heap = []
+        for due, seq, kind, gap, hp_scale, groups, g, n in snap:
+            stream = SpawnStream(groups)
+            stream.g = g
+            stream.n = n
+            self.heap.append((due, seq, kind, gap, hp_scale, stream))
+
+    def pop_due(self, tick):
+        # The next (kind, hp_scale) due by tick, or None.
+        if not self.heap or self.heap[0][0] > tick:
+            return None
+        due, seq, kind, gap, hp_scale, stream = heapq.heappop(self.heap)
+        self.push(due + gap, seq, stream, hp_scale)
+        return kind, hp_scale
+
+TICK_RATE = 60
+SPEEDS = [1, 2, 4, 8]
+
+class FixedStep:
+    # Turns real frame time into a whole number of sim ticks at TICK_RATE,
+    # scaled by the fast-forward speed. A stall longer than max_ticks worth
+    # of frames is dropped rather than replayed; dropped counts those ticks.
+    def __init__(self, rate=TICK_RATE, max_ticks=8):
+        self.dt = 1000.0 / rate
+        self.max_ticks = max_ticks
+        self.speed = 1
+        self.acc = 0.0
+        self.dropped = 0
+
+    def cycle_speed(self):
+        self.speed = SPEEDS[(SPEEDS.index(self.speed) + 1) % len(SPEEDS)]
+
+    def advance(self, ms):
+        self.acc += ms * self.speed
+        n = int(self.acc // self.dt)
+        cap = self.max_ticks * self.speed
+        if n > cap:
+            self.dropped += n - cap
+            n = cap
+            self.acc = 0.0
+        else:
+            self.acc -= n * self.dt
+        return n
+
+    @property
+    def alpha(self):
+        # How far the next tick is into the future, for render interpolation.
+        return self.acc / self.dt
+
+by_dist = attrgetter("dist")
+
+# Player inputs as logged in Sim.log and stored by replay.py:
+# (tick, op, a, b, c) with small integer operands.
+PLACE, UPGRADE, START_WAVE, TARGET = range(4)
+
+class Sim:
+    def __init__(self, w=1280, maph=540, towers=TOWERS, enemies=ENEMIES, waves=WAVES, seed=None, hp_growth=HP_GROWTH):
+        self.map = Map(w, maph)
+        self.tower_defs = towers
+        self.tower_kinds = list(towers)
+        self.enemy_defs = enemies
+        self.waves = waves
+        self.hp_growth = hp_growth
+        self.index = SpatialHash(self.map.cell)
+        self.layout_version = 0
+        self.profile = None
+        # Called with the Sim as a wave starts, still in the build phase.
+        self.on_wave_start = None
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        # Every game gets its own RNG; pass the seed back in to replay it.
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.log = []
+        self.gold = START_GOLD
+        self.lives = MAX_LIVES
+        self.score = 0
+        self.wave_num = 0
+        self.tick = 0
+        self.towers = []
+        self.enemies = []
+        self.bullets = []
+        self.enemy_pool = []
+        self.bullet_pool = []
+        self.order = []
+        self.order_dists = []
+        self.slow_map = None
+        self.spawns = SpawnTimeline()
+        self.state = "build"
+        self.wave_leaks = 0
+        self.wave_kills = 0
+        self.grid_occupied = [[False] * self.map.rows for _ in range(self.map.cols)]
+        self.layout_version += 1
+
+    def can_place(self, col, row):
+        if col < 0 or col >= self.map.cols or row < 0 or row >= self.map.rows:
+            return False
+        if self.grid_occupied[col][row]:
+            return False
+        if (col, row) in self.map.path_cells:
+            return False
+        return True
+
+    def place(self, kind, col, row):
+        d = self.tower_defs[kind]
+        if self.state != "build" or self.gold < d["cost"] or not self.can_place(col, row):
+            return None
+        cell = self.map.cell
+        t = Tower(kind, d, col * cell + cell // 2, row * cell + cell // 2, col, row)
+        self.towers.append(t)
+        self.grid_occupied[col][row] = True
+        self.gold -= d["cost"]
+        self.compile_tower(t)
+        self.layout_version += 1
+        self.log.append((self.tick, PLACE, self.tower_kinds.index(kind), col, row))
+        return t
+
+    def upgrade(self, tower):
+        if self.state != "build" or tower.lv >= MAX_LEVEL:
+            return False
+        cost = tower.upg_cost()
+        if self.gold < cost:
+            return False
+        self.gold -= cost
+        tower.upgrade()
+        self.compile_tower(tower)
+        self.layout_version += 1
+        self.log.append((self.tick, UPGRADE, tower.col, tower.row, 0))
+        return True
+
+    def cycle_target(self, tower):
+        tower.cycle_target()
+        self.log.append((self.tick, TARGET, tower.col, tower.row, 0))
+
+    def tower_at(self, col, row):
+        for t in self.towers:
+            if t.col == col and t.row == row:
+                return t
+        return None
+
+    def apply(self, event):
+        # Re-issues a logged input; returns whatever the original call did.
+        tick, op, a, b, c = event
+        if op == PLACE:
+            return self.place(self.tower_kinds[a], b, c)
+        if op == START_WAVE:
+            return self.start_wave()
+        t = self.tower_at(a, b)
+        if t is None:
+            return None
+        if op == UPGRADE:
+            return self.upgrade(t)
+        if op == TARGET:
+            return self.cycle_target(t)
+        return None
+
+    def compile_tower(self, t):
+        t.cover = self.map.route.coverage(t.x, t.y, t.rng)
+        if t.slow:
+            self.compile_slow()
+
+    def compile_slow(self):
+        spans = [(d0, d1, t.slow) for t in self.towers if t.slow for d0, d1 in t.cover]
+        self.slow_map = SlowMap(spans) if spans else None
+
+    def start_wave(self):
+        if self.state != "build":
+            return False
+        if self.on_wave_start:
+            self.on_wave_start(self)
+        self.spawns.start(self.tick, wave_groups(self.wave_num, self.waves, self.rng),
+                          1.0 + self.wave_num * self.hp_growth)
+        self.wave_leaks = 0
+        self.wave_kills = 0
+        self.state = "wave"
+        self.log.append((self.tick, START_WAVE, 0, 0, 0))
+        return True
+
+    def snapshot(self):
+        # Everything the next tick depends on, as plain data (see rewind.py).
+        # Towers are kept as kind and level and rebuilt by upgrading; the
+        # grid, slow map and spatial index are derived again on restore.
+        enemies, bullets = self.save_units()
+        return {
+            "core": (self.tick, self.gold, self.lives, self.score, self.wave_num, self.state,
+                     self.wave_leaks, self.wave_kills, len(self.log)),
+            "rng": self.rng.getstate(),
+            "towers": tuple((t.kind, t.col, t.row, t.lv, t.target, t.cd) for t in self.towers),
+            "enemies": enemies,
+            "bullets": bullets,
+            "spawns": self.spawns.snapshot(),
+        }
+
+    def restore(self, snap):
+        (self.tick, self.gold, self.lives, self.score, self.wave_num, self.state,
+         self.wave_leaks, self.wave_kills, n_log) = snap["core"]
+        del self.log[n_log:]
+        self.rng.setstate(snap["rng"])
+        cell = self.map.cell
+        self.towers = []
+        self.grid_occupied = [[False] * self.map.rows for _ in range(self.map.cols)]
+        for kind, col, row, lv, target, cd in snap["towers"]:
+            t = Tower(kind, self.tower_defs[kind], col * cell + cell // 2, row * cell + cell // 2, col, row)
+            for _ in range(lv - 1):
+                t.upgrade()
+            t.target = target
+            t.cd = cd
+            t.cover = self.map.route.coverage(t.x, t.y, t.rng)
+            self.towers.append(t)
+            self.grid_occupied[col][row] = True
+        self.compile_slow()
+        self.load_units(snap["enemies"], snap["bullets"])
+        self.spawns.restore(snap["spawns"])
+        self.layout_version += 1
+
+    def enemy_count(self):
+        return len(self.enemies)
+
+    def save_units(self):
+        ids = {id(e): i for i, e in enumerate(self.enemies)}
+        enemies = tuple((e.kind, e.max_hp, e.hp, e.speed, e.dist, e.x, e.y, e.px, e.py) for e in self.enemies)
+        bullets = tuple((b.x, b.y, b.px, b.py, ids[id(b.target)], b.dmg, b.splash) for b in self.bullets)
+        return enemies, bullets
+
+    def load_units(self, enemies, bullets):
+        self.enemy_pool.extend(self.enemies)
+        self.enemies = []
+        for kind, max_hp, hp, speed, dist, x, y, px, py in enemies:
+            e = self.spawn(kind, 1.0)
+            e.max_hp, e.hp, e.speed, e.dist = max_hp, hp, speed, dist
+            e.x, e.y, e.px, e.py = x, y, px, py
+        self.bullets = []
+        for x, y, px, py, i, dmg, splash in bullets:
+            b = Bullet(x, y, self.enemies[i], dmg, splash)
+            b.px, b.py = px, py
+            self.bullets.append(b)
+
+    def spawn(self, kind, hp_scale):
+        if self.enemy_pool:
+            e = self.enemy_pool.pop()
+            e.setup(kind, self.enemy_defs[kind], self.map.route, hp_scale)
+        else:
+            e = Enemy(kind, self.enemy_defs[kind], self.map.route, hp_scale)
+        self.enemies.append(e)
+        return e
+
+    def fire(self, t, target):
+        if self.bullet_pool:
+            b = self.bullet_pool.pop()
+            b.setup(t.x, t.y, target, t.dmg, t.splash)
+        else:
+            b = Bullet(t.x, t.y, target, t.dmg, t.splash)
+        self.bullets.append(b)
+        return b
+
+    def compact(self):
+        # Drops dead entities in place and recycles them. A bullet whose
+        # target died would expire at the start of next tick anyway; expire
+        # it now so no live bullet can point at a recycled enemy.
+        bullets = self.bullets
+        pool = self.bullet_pool
+        j = 0
+        for b in bullets:
+            if b.alive and b.target.alive:
+                bullets[j] = b
+                j += 1
+            else:
+                b.target = None
+                pool.append(b)
+        del bullets[j:]
+
+        enemies = self.enemies
+        pool = self.enemy_pool
+        j = 0
+        for e in enemies:
+            if e.alive:
+                enemies[j] = e
+                j += 1
+            else:
+                pool.append(e)
+        del enemies[j:]
+
+    def step(self):
+        if self.state != "wave":
+            return
+        prof = self.profile
+        self.tick += 1
+        due = self.spawns.pop_due(self.tick)
+        while due:
+            self.spawn(*due)
+            due = self.spawns.pop_due(self.tick)
+        if prof:
+            prof.mark("spawn")
+
+        slow = self.slow_map
+        for e in self.enemies:
+            e.update()
+            if e.leaked:
+                self.lives -= e.leak_dmg
+                self.wave_leaks += 1
+                if self.lives <= 0:
+                    self.state = "gameover"
+            elif slow:
+                e.speed = e.base_speed * slow.factor(e.dist)
+
+        self.index.rebuild(self.enemies)
+        order = self.order
+        order[:] = [e for e in self.enemies if e.alive]
+        order.sort(key=by_dist)
+        dists = self.order_dists
+        dists[:] = [e.dist for e in order]
+        if prof:
+            prof.mark("move")
+
+        for t in self.towers:
+            target = t.update(order, dists)
+            if target:
+                self.fire(t, target)
+        if prof:
+            prof.mark("target")
+
+        for b in self.bullets:
+            b.update(self.index)
+
+        for e in self.enemies:
+            if not e.alive and not e.leaked:
+                self.gold += e.reward
+                self.score += e.reward
+                self.wave_kills += 1
+        self.compact()
+
+        if not self.spawns and not self.enemies and self.state == "wave":
+            self.wave_num += 1
+            self.gold += 30 + self.wave_num * 8
+            self.state = "build"
+        if prof:
+            prof.mark("bullets")
+
+    def run_wave(self, max_ticks=100000):
+        wave = self.wave_num
+        start = self.tick
+        if not self.start_wave():
+            return None
+        while self.state == "wave" and self.tick - start < max_ticks:
+            self.step()
+        return {
+            "wave": wave + 1,
+            "ticks": self.tick - start,
+            "leaks": self.wave_leaks,
+            "kills": self.wave_kills,
+            "lives": self.lives,
+            "gold": self.gold,
+            "state": self.state,
+        }
@@ -0,0 +1,229 @@
+import argparse, hashlib, itertools, json, os, sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import sim
+from sim import Sim
+
+# Headless balance sweeps. Every combination of the parameter grids is
+# played with each fixed tower layout and seed on a process pool, and each
+# game reports leaks, lives and gold per wave plus the wave it reached.
+# Finished games are cached by their full configuration, so re-running a
+# sweep only plays the combinations that are new.
+#
+#   python sweep.py -p enemy.raider.hp=60,70,90 -p hp_growth=0.12,0.15
+#   python sweep.py -p tower.bowman.dmg=15,18,21 -l bowmen -l mixed --seeds 4
+#   python sweep.py -p wave.6.shield.count=3,4,6 --waves 12 --out runs.jsonl
+#
+# Parameters:
+#   enemy.KIND.STAT          hp, speed, reward, leak
+#   tower.KIND.STAT          cost, rng, dmg, rate, upg_cost, splash, slow
+#   wave.N.KIND.count|delay  group of KIND in wave N (counted from 1)
+#   wave.N.KIND.start        start that group this many ticks into the wave,
+#                            overlapping the others
+#   hp_growth                per-wave enemy hp scale (1 + wave * hp_growth)
+
+# Build orders, tried before every wave in order until one is unaffordable.
+# ("kind", col, row) places a tower, ("up", col, row) upgrades one.
+LAYOUTS = {
+    "bowmen": [
+        ("bowman", 5, 3), ("bowman", 7, 2), ("bowman", 11, 3), ("bowman", 13, 4),
+        ("up", 5, 3), ("up", 7, 2), ("bowman", 5, 5), ("bowman", 11, 2),
+        ("up", 11, 3), ("up", 13, 4), ("up", 5, 3), ("up", 7, 2),
+        ("up", 5, 5), ("up", 11, 2), ("up", 11, 3), ("up", 13, 4),
+    ],
+    "mixed": [
+        ("bowman", 5, 3), ("bowman", 7, 2), ("guard", 7, 3), ("crossbow", 11, 3),
+        ("bowman", 13, 4), ("up", 5, 3), ("crossbow", 13, 6), ("up", 7, 2),
+        ("up", 11, 3), ("guard", 11, 4), ("up", 13, 4), ("up", 13, 6),
+        ("up", 5, 3), ("up", 7, 2), ("up", 11, 3), ("up", 13, 6),
+    ],
+    "splash": [
+        ("bowman", 5, 3), ("crossbow", 7, 2), ("crossbow", 11, 3), ("guard", 13, 4),
+        ("crossbow", 13, 6), ("up", 7, 2), ("up", 11, 3), ("up", 13, 6),
+        ("bowman", 7, 3), ("up", 7, 2), ("up", 11, 3), ("up", 13, 6),
+    ],
+}
+
+CACHE = "sweep_cache.jsonl"
+
+def sim_version():
+    # Results are only reusable while the game rules stay the same.
+    with open(sim.__file__, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+def parse_value(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def parse_param(spec):
+    name, _, values = spec.partition("=")
+    if not values:
+        raise ValueError(f"{spec}: expected NAME=V1,V2,...")
+    return name, [parse_value(v) for v in values.split(",")]
+
+def base_tables():
+    return {
+        "enemies": {k: dict(v) for k, v in sim.ENEMIES.items()},
+        "towers": {k: {s: v for s, v in d.items() if s not in ("name", "col", "desc")}
+                   for k, d in sim.TOWERS.items()},
+        "waves": [[list(g) for g in wave] for wave in sim.WAVES],
+        "hp_growth": sim.HP_GROWTH,
+    }
+
+def apply_param(tables, name, value):
+    parts = name.split(".")
+    if parts == ["hp_growth"]:
+        tables["hp_growth"] = value
+    elif parts[0] == "enemy" and len(parts) == 3 and parts[1] in tables["enemies"]:
+        tables["enemies"][parts[1]][parts[2]] = value
+    elif parts[0] == "tower" and len(parts) == 3 and parts[1] in tables["towers"]:
+        tables["towers"][parts[1]][parts[2]] = value
+    elif parts[0] == "wave" and len(parts) == 4 and parts[3] in ("count", "delay", "start"):
+        waves = tables["waves"]
+        if not parts[1].isdigit() or not 1 <= int(parts[1]) <= len(waves):
+            raise ValueError(f"{name}: wave must be 1..{len(waves)}")
+        wave = waves[int(parts[1]) - 1]
+        groups = [g for g in wave if g[0] == parts[2]]
+        if not groups:
+            raise ValueError(f"{name}: wave {parts[1]} has no {parts[2]} group")
+        for g in groups:
+            i = ("count", "delay", "start").index(parts[3]) + 1
+            g[i:i + 1] = [value]
+    else:
+        raise ValueError(f"{name}: unknown parameter")
+
+def build(game, steps, done):
+    # Plays the build order from where it left off; returns the new position.
+    while done < len(steps):
+        kind, col, row = steps[done]
+        if kind == "up":
+            t = game.tower_at(col, row)
+            if t is None or not game.upgrade(t):
+                break
+        elif not game.place(kind, col, row):
+            break
+        done += 1
+    return done
+
+def play(task):
+    tables = task["tables"]
+    towers = {k: dict(sim.TOWERS[k], **v) for k, v in tables["towers"].items()}
+    game = Sim(towers=towers, enemies=tables["enemies"], waves=tables["waves"],
+               seed=task["seed"], hp_growth=tables["hp_growth"])
+    steps = [tuple(s) for s in task["steps"]]
+    done = 0
+    waves = []
+    while game.state == "build" and len(waves) < task["max_waves"]:
+        done = build(game, steps, done)
+        r = game.run_wave()
+        waves.append({"leaks": r["leaks"], "lives": r["lives"], "gold": r["gold"]})
+    return {"reached": len(waves), "survived": game.state != "gameover", "waves": waves}
+
+def task_key(task):
+    return hashlib.sha1(json.dumps(task, sort_keys=True).encode()).hexdigest()
+
+def load_cache(path):
+    cache = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                cache[entry["key"]] = entry["result"]
+    return cache
+
+def describe(params):
+    return " ".join(f"{k}={v}" for k, v in params) or "baseline"
+
+def report(n, total, row, tag):
+    r = row["result"]
+    leaks = ",".join(str(w["leaks"]) for w in r["waves"])
+    gold = ",".join(str(w["gold"]) for w in r["waves"])
+    end = "survived" if r["survived"] else "lost"
+    print(f"[{n}/{total}]{tag} {describe(row['params'])} layout={row['layout']} seed={row['seed']}: "
+          f"wave {r['reached']} {end}  leaks {leaks}  gold {gold}", flush=True)
+
+def summarize(rows):
+    groups = {}
+    for row in rows:
+        groups.setdefault((describe(row["params"]), row["layout"]), []).append(row["result"])
+    print()
+    print(f"{'config':<40} {'layout':<8} {'games':>5} {'wave':>6} {'lost':>5} {'leaks':>6}")
+    for (config, layout), results in sorted(groups.items()):
+        n = len(results)
+        wave = sum(r["reached"] for r in results) / n
+        lost = sum(not r["survived"] for r in results)
+        leaks = sum(w["leaks"] for r in results for w in r["waves"]) / n
+        print(f"{config:<40} {layout:<8} {n:>5} {wave:>6.1f} {lost:>5} {leaks:>6.1f}")
+
+def main(argv):
+    ap = argparse.ArgumentParser(description="Headless balance sweep over the sim tables.")
+    ap.add_argument("-p", "--param", action="append", default=[], metavar="NAME=V1,V2",
+                    help="parameter grid; repeat for a cartesian product")
+    ap.add_argument("-l", "--layout", action="append", choices=sorted(LAYOUTS),
+                    help="tower layout to play (default: all)")
+    ap.add_argument("--seeds", type=int, default=3, help="games per configuration and layout")
+    ap.add_argument("--waves", type=int, default=20, help="stop after this many waves")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    ap.add_argument("--cache", default=CACHE, help="result cache file")
+    ap.add_argument("--out", help="also write every result as a JSON line to this file")
+    args = ap.parse_args(argv[1:])
+
+    try:
+        grids = [parse_param(p) for p in args.param]
+        base = base_tables()
+        for name, values in grids:
+            apply_param(base_tables(), name, values[0])
+    except ValueError as e:
+        ap.error(str(e))
+
+    version = sim_version()
+    rows = []
+    for combo in itertools.product(*[[(name, v) for v in values] for name, values in grids]):
+        tables = json.loads(json.dumps(base))
+        for name, value in combo:
+            apply_param(tables, name, value)
+        for layout in args.layout or sorted(LAYOUTS):
+            for seed in range(args.seeds):
+                task = {"tables": tables, "steps": LAYOUTS[layout], "seed": seed,
+                        "max_waves": args.waves, "sim": version}
+                rows.append({"params": list(combo), "layout": layout, "seed": seed,
+                             "task": task, "key": task_key(task)})
+
+    cache = load_cache(args.cache)
+    total = len(rows)
+    n = 0
+    out = open(args.out, "w") if args.out else None
+    todo = []
+    for row in rows:
+        if row["key"] in cache:
+            row["result"] = cache[row["key"]]
+            n += 1
+            report(n, total, row, " cached")
+            if out:
+                out.write(json.dumps({k: row[k] for k in ("params", "layout", "seed", "result")}) + "\n")
+        else:
+            todo.append(row)
+
+    with open(args.cache, "a") as cache_file, ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(play, row["task"]): row for row in todo}
+        for fut in as_completed(futures):
+            row = futures[fut]
+            row["result"] = fut.result()
+            n += 1
+            report(n, total, row, "")
+            cache_file.write(json.dumps({"key": row["key"], "result": row["result"]}) + "\n")
+            cache_file.flush()
+            if out:
+                out.write(json.dumps({k: row[k] for k in ("params", "layout", "seed", "result")}) + "\n")
+                out.flush()
+    if out:
+        out.close()
+
+    summarize(rows)
+    print(f"\n{total} games, {total - len(todo)} from cache, {len(todo)} played")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
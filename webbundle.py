@@ -0,0 +1,132 @@
+import argparse, ast, hashlib, json, os, shutil, sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+from assets import MAP_ASSETS, ENEMY_ASSETS, WEB_BUNDLE
+from gfx import AssetLoader
+
+# Builds the pre-scaled image bundle for the web build. Every image is
+# written once per size it is drawn at into web_assets/, as JPEG when it is
+# opaque and PNG when it has alpha, and web_assets/manifest.json maps each
+# original file and size to its bundle file. The browser then loads these
+# small files directly instead of decoding and scaling the full-size
+# originals. Images whose source hash is unchanged are not rebuilt.
+#
+#   python webbundle.py                     build or refresh web_assets/
+#   python webbundle.py --stage build/site  also copy what the web build needs
+#   python -m pygbag build/site             package the staged copy
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+OUT = os.path.join(DIR, WEB_BUNDLE)
+MANIFEST = "manifest.json"
+VERSION = 1
+
+# What the browser build runs: main.py, every project module it imports
+# (see web_files()) and these. pygbag packs the whole folder it is given,
+# so staging only these keeps the full-size originals out of the download.
+WEB_ENTRY = "main.py"
+WEB_EXTRA = ["favicon.png"]
+
+def web_files(root, entry=WEB_ENTRY):
+    # The entry script plus the project modules it imports, followed
+    # recursively. Imports inside functions and branches count too, since
+    # the browser may take them.
+    files = []
+    todo = [entry]
+    while todo:
+        name = todo.pop()
+        if name in files:
+            continue
+        files.append(name)
+        with open(os.path.join(root, name)) as f:
+            tree = ast.parse(f.read(), name)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                mods = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level:
+                mods = [node.module]
+            else:
+                continue
+            for mod in mods:
+                path = mod.split(".")[0] + ".py"
+                if os.path.exists(os.path.join(root, path)):
+                    todo.append(path)
+    return sorted(files) + WEB_EXTRA
+
+def load_manifest(out):
+    path = os.path.join(out, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    return data["images"] if data.get("version") == VERSION else {}
+
+def build(root, out):
+    os.makedirs(out, exist_ok=True)
+    old = load_manifest(out)
+    images = {}
+    built = kept = 0
+    for filename, sizes in sorted(AssetLoader(root).wanted({**MAP_ASSETS, **ENEMY_ASSETS}).items()):
+        with open(os.path.join(root, filename), "rb") as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        prev = old.get(filename, {})
+        entry = {"sha1": digest, "sizes": {}}
+        src = None
+        for size in sorted(sizes):
+            name = prev.get("sizes", {}).get(str(size))
+            if prev.get("sha1") == digest and name and os.path.exists(os.path.join(out, name)):
+                entry["sizes"][str(size)] = name
+                kept += 1
+                continue
+            if src is None:
+                src = pygame.image.load(os.path.join(root, filename))
+            alpha = src.get_flags() & pygame.SRCALPHA
+            name = f"{os.path.splitext(filename)[0]}-{size}.{'png' if alpha else 'jpg'}"
+            img = pygame.transform.smoothscale(src, (size, size))
+            pygame.image.save(img, os.path.join(out, name))
+            entry["sizes"][str(size)] = name
+            built += 1
+        images[filename] = entry
+
+    # Drop bundle files the previous build made that nothing uses any more.
+    used = {n for e in images.values() for n in e["sizes"].values()}
+    for name in {n for e in old.values() for n in e["sizes"].values()} - used:
+        if os.path.exists(os.path.join(out, name)):
+            os.remove(os.path.join(out, name))
+    with open(os.path.join(out, MANIFEST), "w") as f:
+        json.dump({"version": VERSION, "images": images}, f, indent=1, sort_keys=True)
+    return built, kept
+
+def stage(root, out, dest):
+    os.makedirs(dest, exist_ok=True)
+    for name in web_files(root):
+        shutil.copy2(os.path.join(root, name), os.path.join(dest, name))
+    bundle = os.path.join(dest, WEB_BUNDLE)
+    if os.path.exists(bundle):
+        shutil.rmtree(bundle)
+    shutil.copytree(out, bundle)
+
+def size_of(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+def main(argv):
+    ap = argparse.ArgumentParser(description="Build the pre-scaled image bundle for the web build.")
+    ap.add_argument("--out", default=OUT, help="bundle directory")
+    ap.add_argument("--stage", metavar="DIR", help="copy the web build's files and the bundle here")
+    args = ap.parse_args(argv[1:])
+
+    built, kept = build(DIR, args.out)
+    files = load_manifest(args.out)
+    before = size_of(os.path.join(DIR, f) for f in files)
+    after = size_of(os.path.join(args.out, n) for e in files.values() for n in e["sizes"].values())
+    print(f"{built} images built, {kept} unchanged: {len(files)} originals "
+          f"{before / 1024:.0f} KB -> bundle {after / 1024:.0f} KB")
+    if args.stage:
+        stage(DIR, args.out, args.stage)
+        print(f"staged web build in {args.stage}; package it with: python -m pygbag {args.stage}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))